@@ -0,0 +1,220 @@
+"""
+A small in-process stand-in for the Netbox REST API, serving fixture data with the paging, brief mode, filters and
+bulk writes that netbox-utils uses, and an optional delay per request to imitate a remote server.
+"""
+import ipaddress
+import json
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timezone
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+API_VERSION = '3.7'
+MAX_PAGE_SIZE = 1000
+
+# Filters that aren't a simple match against a field of the same name
+ALIASES = {
+    ('dcim/devices', 'role'): 'device_role',
+}
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def _field_values(value: Any) -> List[str]:
+    """The strings a filter value can match a field by: nested objects match on id, slug, name or value"""
+    if value is None:
+        return ['null']
+    if isinstance(value, dict):
+        return [str(value[key]) for key in ('id', 'slug', 'name', 'value') if key in value]
+    return [str(value)]
+
+
+class FakeNetbox:
+    def __init__(self, data: Dict[str, List[Dict[str, Any]]], latency: float = 0.0):
+        self.objects: Dict[str, Dict[int, Dict[str, Any]]] = {path: {obj['id']: obj for obj in objs}
+                                                             for path, objs in data.items()}
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._networks: Dict[Tuple[str, int], Tuple[int, int, int]] = {}
+        self._results: Dict[Tuple[str, tuple], List[Dict[str, Any]]] = {}
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def base_url(self) -> str:
+        return 'http://%s:%d' % self._server.server_address
+
+    @property
+    def url(self) -> str:
+        return self.base_url + '/api'
+
+    def start(self) -> str:
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _make_handler(self))
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.base_url
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _network(self, path: str, obj: Dict[str, Any]) -> Tuple[int, int, int]:
+        """(version, first, last) of an object's prefix or address, cached as parsing them all is slow"""
+        key = (path, obj['id'])
+        if key not in self._networks:
+            if 'prefix' in obj:
+                network = ipaddress.ip_network(obj['prefix'])
+            else:
+                network = ipaddress.ip_network(obj['address'].split('/')[0])
+            self._networks[key] = (network.version, int(network.network_address), int(network.broadcast_address))
+        return self._networks[key]
+
+    def _filter(self, path: str, key: str, values: List[str]) -> Callable[[Dict[str, Any]], bool]:
+        if key in ('contains', 'parent'):
+            bounds = []
+            for value in values:
+                network = ipaddress.ip_network(value, strict=False)
+                bounds.append((network.version, int(network.network_address), int(network.broadcast_address)))
+
+            def match_network(obj: Dict[str, Any]) -> bool:
+                version, first, last = self._network(path, obj)
+                if key == 'contains':
+                    return any(version == v and first <= f and l <= last for v, f, l in bounds)
+                return any(version == v and f <= first and last <= l for v, f, l in bounds)
+            return match_network
+        if key == 'device_id':
+            ids = set(values)
+            return lambda obj: (obj.get('assigned_object_type') == 'dcim.device' and
+                                str(obj['assigned_object_id']) in ids)
+        if key.endswith('__gte'):
+            field, lowest = key[:-len('__gte')], min(values)
+            return lambda obj: obj.get(field) is not None and obj[field] >= lowest
+        if key.endswith('__empty'):
+            field, empty = key[:-len('__empty')], values[-1].lower() in ('true', '1')
+            return lambda obj: (not obj.get(field)) == empty
+        if key.endswith('_id') and key != 'id':
+            field, ids = ALIASES.get((path, key[:-3]), key[:-3]), set(values)
+            return lambda obj: (str(obj[field]['id']) if obj.get(field) else 'null') in ids
+        field, wanted = ALIASES.get((path, key), key), set(values)
+        return lambda obj: not wanted.isdisjoint(_field_values(obj.get(field)))
+
+    def _matching(self, path: str, query: Dict[str, List[str]]) -> List[Dict[str, Any]]:
+        # Paging through a result asks for the same filter once per page, so keep the result until the next write
+        filters = tuple(sorted((key, tuple(values)) for key, values in query.items()
+                               if key not in ('limit', 'offset', 'brief', 'fields', 'ordering')))
+        if (path, filters) not in self._results:
+            objs = list(self.objects.get(path, {}).values())
+            for key, values in filters:
+                objs = list(filter(self._filter(path, key, list(values)), objs))
+            self._results[(path, filters)] = objs
+        return self._results[(path, filters)]
+
+    def list(self, path: str, query: Dict[str, List[str]]) -> Dict[str, Any]:
+        objs = self._matching(path, query)
+
+        limit = min(int(query.get('limit', ['50'])[-1]) or MAX_PAGE_SIZE, MAX_PAGE_SIZE)
+        offset = int(query.get('offset', ['0'])[-1])
+        page = objs[offset:offset + limit]
+        if query.get('brief', ['0'])[-1].lower() in ('1', 'true'):
+            page = [{'id': obj['id'], 'url': '%s/%s/%d/' % (self.url, path, obj['id']),
+                     'display': obj.get('name', str(obj['id']))} for obj in page]
+        elif 'fields' in query:
+            fields = query['fields'][-1].split(',')
+            page = [{field: obj.get(field) for field in fields} for obj in page]
+
+        next_url = None
+        if offset + limit < len(objs):
+            next_query = dict(query, offset=[str(offset + limit)], limit=[str(limit)])
+            next_url = '%s/%s/?%s' % (self.url, path, urllib.parse.urlencode(next_query, doseq=True))
+        return {'count': len(objs), 'next': next_url, 'previous': None, 'results': page}
+
+    def create(self, path: str, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._results.clear()
+            store = self.objects.setdefault(path, {})
+            created = []
+            next_id = max(store, default=0) + 1
+            for next_id, item in enumerate(items, next_id):
+                obj = dict(item, id=next_id, last_updated=_now())
+                store[obj['id']] = obj
+                created.append(obj)
+            return created
+
+    def update(self, path: str, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._results.clear()
+            updated = []
+            for item in items:
+                obj = self.objects[path][item['id']]
+                obj.update(item, last_updated=_now())
+                self._networks.pop((path, obj['id']), None)
+                updated.append(obj)
+            return updated
+
+
+def _make_handler(netbox: FakeNetbox):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, code: int, body: Any):
+            content = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.send_header('API-Version', API_VERSION)
+            self.send_header('Date', formatdate(usegmt=True))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def _start(self) -> Tuple[str, Dict[str, List[str]]]:
+            netbox.requests += 1
+            if netbox.latency:
+                time.sleep(netbox.latency)
+            url = urllib.parse.urlsplit(self.path)
+            return url.path[len('/api/'):].strip('/'), urllib.parse.parse_qs(url.query)
+
+        def _body(self) -> bytes:
+            return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        def do_GET(self):
+            path, query = self._start()
+            if path == '':
+                return self._send(200, {app: '%s/%s/' % (netbox.url, app)
+                                        for app in sorted({path.split('/')[0] for path in netbox.objects})})
+            if path == 'status':
+                return self._send(200, {'netbox-version': API_VERSION + '.0', 'python-version': '3', 'plugins': {}})
+            if path in netbox.objects:
+                return self._send(200, netbox.list(path, query))
+            base, _, obj_id = path.rpartition('/')
+            if obj_id.isdigit() and int(obj_id) in netbox.objects.get(base, {}):
+                return self._send(200, netbox.objects[base][int(obj_id)])
+            self._send(404, {'detail': 'Not found.'})
+
+        def do_POST(self):
+            path, _ = self._start()
+            content = self._body()
+            if path == 'secrets/get-session-key':
+                return self._send(200, {'session_key': 'benchmark-session-key'})
+            body = json.loads(content)
+            if path not in netbox.objects:
+                return self._send(404, {'detail': 'Not found.'})
+            created = netbox.create(path, body if isinstance(body, list) else [body])
+            self._send(201, created if isinstance(body, list) else created[0])
+
+        def do_PATCH(self):
+            path, _ = self._start()
+            body = json.loads(self._body())
+            if isinstance(body, list):
+                return self._send(200, netbox.update(path, body))
+            base, _, obj_id = path.rpartition('/')
+            self._send(200, netbox.update(base, [dict(body, id=int(obj_id))])[0])
+
+    return Handler
@@ -0,0 +1,110 @@
+"""
+Synthetic Netbox data for the benchmarks: aggregates, prefixes, IP addresses with DNS names, devices, virtual machines
+and secrets, scaled from the number of IP addresses and reproducible for a given seed.
+"""
+import ipaddress
+import random
+from typing import Any, Dict, List
+
+SCALES = {
+    '1k': 1_000,
+    '10k': 10_000,
+    '100k': 100_000,
+    '1m': 1_000_000,
+}
+
+FORWARD_DOMAINS = ['example.com', 'example.net']
+SUBDOMAINS = ['', 'lon.', 'ams.', 'mgmt.lon.']
+
+# Everything starts out as last updated at the same time, so cache syncs after it only see the benchmark's own changes
+LAST_UPDATED = '2024-01-01T00:00:00.000000Z'
+
+V4_BASE = ipaddress.IPv4Network('10.0.0.0/8')
+V6_BASE = ipaddress.IPv6Network('2001:db8::/32')
+
+
+def parse_scale(scale: str) -> int:
+    return SCALES[scale.lower()] if scale.lower() in SCALES else int(scale)
+
+
+def _nested(obj_id: int, name: str) -> Dict[str, Any]:
+    return {'id': obj_id, 'name': name, 'slug': name.lower().replace(' ', '-'), 'display': name}
+
+
+def generate(ip_count: int, seed: int = 0) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Build the objects for each API endpoint path, sorted by id. Nine in ten addresses are IPv4, packed 250 to a /24
+    prefix, and the rest IPv6, 250 to a /64. About 70% have a DNS name in one of FORWARD_DOMAINS.
+    """
+    rand = random.Random(seed)
+    data: Dict[str, List[Dict[str, Any]]] = {}
+
+    v6_count = ip_count // 10
+    v4_count = ip_count - v6_count
+    active = {'value': 'active', 'label': 'Active'}
+
+    # The IPv4 aggregate only just covers the prefixes, as every /24 in it gets a reverse zone
+    v4_prefixes = (v4_count + 249) // 250
+    v4_aggregate = ipaddress.IPv4Network((V4_BASE.network_address, 24 - (v4_prefixes - 1).bit_length()))
+    data['ipam/aggregates'] = [
+        {'id': 1, 'prefix': str(v4_aggregate), 'rir': _nested(1, 'RFC1918'), 'last_updated': LAST_UPDATED},
+        {'id': 2, 'prefix': str(V6_BASE), 'rir': _nested(2, 'RFC3849'), 'last_updated': LAST_UPDATED},
+    ]
+
+    prefixes = []
+    for pos in range(v4_prefixes):
+        prefixes.append(ipaddress.IPv4Network((int(V4_BASE.network_address) + pos * 256, 24)))
+    for pos in range((v6_count + 249) // 250):
+        prefixes.append(ipaddress.IPv6Network((int(V6_BASE.network_address) + (pos << 64), 64)))
+    data['ipam/prefixes'] = [{'id': prefix_id, 'prefix': str(network), 'vrf': None, 'tenant': None, 'status': active,
+                              'last_updated': LAST_UPDATED}
+                             for prefix_id, network in enumerate(prefixes, 1)]
+
+    addresses = []
+    for pos in range(ip_count):
+        if pos < v4_count:
+            prefix, host = divmod(pos, 250)
+            address = '%s/24' % ipaddress.IPv4Address(int(V4_BASE.network_address) + prefix * 256 + host + 2)
+        else:
+            prefix, host = divmod(pos - v4_count, 250)
+            address = '%s/64' % ipaddress.IPv6Address(int(V6_BASE.network_address) + (prefix << 64) + host + 2)
+        dns_name = ''
+        if rand.random() < 0.7:
+            dns_name = 'host%d.%s%s' % (pos, rand.choice(SUBDOMAINS), rand.choice(FORWARD_DOMAINS))
+        addresses.append({'id': pos + 1, 'address': address, 'dns_name': dns_name, 'vrf': None, 'tenant': None,
+                          'status': active, 'last_updated': LAST_UPDATED})
+    data['ipam/ip-addresses'] = addresses
+
+    sites = [_nested(site_id, 'Site %d' % site_id) for site_id in range(1, 21)]
+    roles = [_nested(role_id, name) for role_id, name in enumerate(['Router', 'Switch', 'Server', 'PDU', 'Console'], 1)]
+    devices = []
+    for device_id in range(1, max(ip_count // 20, 10) + 1):
+        primary_ip4 = addresses[device_id % v4_count]
+        devices.append({'id': device_id, 'name': 'device%06d' % device_id, 'site': rand.choice(sites),
+                        'device_role': rand.choice(roles),
+                        'primary_ip4': {'id': primary_ip4['id'], 'family': 4, 'address': primary_ip4['address']},
+                        'primary_ip6': None, 'last_updated': LAST_UPDATED})
+    data['dcim/devices'] = devices
+
+    clusters = [_nested(cluster_id, 'Cluster %d' % cluster_id) for cluster_id in range(1, 6)]
+    vms = [{'id': vm_id, 'name': 'vm%06d' % vm_id, 'cluster': rand.choice(clusters), 'primary_ip4': None,
+            'primary_ip6': None, 'last_updated': LAST_UPDATED}
+           for vm_id in range(1, max(ip_count // 100, 5) + 1)]
+    data['virtualization/virtual-machines'] = vms
+
+    # Two secrets on every other device, and one on every fifth virtual machine
+    secret_roles = [_nested(1, 'Login'), _nested(2, 'OOB')]
+    secrets = []
+    for device in devices[::2]:
+        for role in secret_roles:
+            secrets.append({'assigned_object_type': 'dcim.device', 'assigned_object_id': device['id'],
+                            'assigned_object': _nested(device['id'], device['name']), 'role': role})
+    for vm in vms[::5]:
+        secrets.append({'assigned_object_type': 'virtualization.virtualmachine', 'assigned_object_id': vm['id'],
+                        'assigned_object': _nested(vm['id'], vm['name']), 'role': secret_roles[0]})
+    for secret_id, secret in enumerate(secrets, 1):
+        secret.update({'id': secret_id, 'name': 'admin', 'plaintext': 'secret%d' % secret_id,
+                       'last_updated': LAST_UPDATED})
+    data['secrets/secrets'] = secrets
+
+    return data
@@ -0,0 +1,84 @@
+"""
+Compare finding each name's forward zone with the origin index in ZonesGenerator against the scan over every zone that
+it replaced, as the number of zones grows. Besides the forward zones, every zone is a /24 reverse zone, as generated
+for an IPv4 aggregate. The scan is timed on a sample of the names and scaled up.
+
+    python benchmarks/forward_lookup.py --zones 100 --zones 1000 --zones 10000
+"""
+import ipaddress
+import random
+import sys
+import time
+from typing import Dict, List, Optional
+
+import click
+
+from fixtures import FORWARD_DOMAINS, SUBDOMAINS
+from run import ROOT
+
+sys.path.insert(0, ROOT)
+
+import dns.name  # noqa: E402
+import dns.zone  # noqa: E402
+
+from netbox_utils.nbdns.zones_generator import ZonesGenerator  # noqa: E402
+from netbox_utils.prefix_index import PrefixIndex  # noqa: E402
+
+# A zone inside another, which the lookup must prefer for names in it
+NESTED_DOMAIN = 'lon.' + FORWARD_DOMAINS[0]
+
+
+def scan(zones: Dict[str, dns.zone.Zone], name: dns.name.Name) -> Optional[str]:
+    # How _add_host_records found the forward zone before the index. Parents come before their children in zones, so
+    # the last match is the most specific.
+    forward_zone = None
+    for zone in zones.values():
+        if name.is_subdomain(zone.origin):
+            forward_zone = zone
+    return forward_zone.origin.to_text() if forward_zone else None
+
+
+@click.command()
+@click.option('--zones', 'zone_counts', type=click.IntRange(min=len(FORWARD_DOMAINS) + 1), multiple=True,
+              default=[100, 1000, 10000], show_default=True, help='Total number of zones. May be repeated.')
+@click.option('--names', 'name_count', type=click.IntRange(min=1), default=10000, show_default=True,
+              help='Number of names to look up')
+@click.option('--scan-sample', type=click.IntRange(min=1), default=1000, show_default=True,
+              help='Names to time the scan on')
+@click.option('--seed', type=int, default=0, show_default=True, help='Seed for the names')
+def main(zone_counts: List[int], name_count: int, scan_sample: int, seed: int):
+    rand = random.Random(seed)
+    names = [dns.name.from_text('host%d.%s%s' % (pos, rand.choice(SUBDOMAINS), rand.choice(FORWARD_DOMAINS)))
+             for pos in range(name_count)]
+    sample = names[:scan_sample]
+
+    for zone_count in zone_counts:
+        zonegen = ZonesGenerator(None, 'ns1.example.com.', 'hostmaster.example.com.', 3600, 600, 604800, 3600,
+                                 ['ns1.example.com.'])
+        zonegen.reverse_zones = PrefixIndex()
+        reverse_count = zone_count - len(FORWARD_DOMAINS) - 1
+        for pos in range(reverse_count):
+            zonegen._create_reverse_zone(ipaddress.IPv4Network((0x0a000000 + pos * 256, 24)))
+        zonegen.forward_zones = {}
+        for domain in FORWARD_DOMAINS + [NESTED_DOMAIN]:
+            zone = zonegen._create_zone(domain + '.')
+            zonegen.forward_zones[zone.origin] = domain + '.'
+
+        start = time.perf_counter()
+        found = [zonegen._find_forward_zone(name) for name in names]
+        index_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        scanned = [scan(zonegen.zones, name) for name in sample]
+        scan_time = (time.perf_counter() - start) * len(names) / len(sample)
+        if scanned != found[:len(sample)]:
+            print('The index and the scan found different zones', file=sys.stderr)
+            sys.exit(1)
+
+        print('%6d zones, %d names: index %7.3fs  scan %9.2fs%s  (%.0fx)' % (
+            zone_count, len(names), index_time, scan_time, '' if len(sample) == len(names) else ' (est.)',
+            scan_time / index_time))
+
+
+if __name__ == '__main__':
+    main()
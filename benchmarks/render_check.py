@@ -0,0 +1,102 @@
+"""
+Check the zone files written by `dns generate`, rendered in one process and with --render-jobs, against dnspython's:
+generate zones from synthetic data once, write them both ways to separate directories, and compare every file byte
+for byte with what dns.zone.Zone.to_file(sorted=True) writes for a zone holding the same records.
+
+    python benchmarks/render_check.py --scale 100k --render-jobs 4
+"""
+import io
+import os
+import sys
+import tempfile
+import time
+from configparser import ConfigParser
+
+import click
+
+from fake_netbox import FakeNetbox
+from fixtures import FORWARD_DOMAINS, generate, parse_scale
+from run import ROOT
+
+sys.path.insert(0, ROOT)
+
+import dns.name  # noqa: E402
+import dns.rdata  # noqa: E402
+import dns.rdataclass  # noqa: E402
+import dns.rdatatype  # noqa: E402
+import dns.zone  # noqa: E402
+
+from netbox_utils import get_api  # noqa: E402
+from netbox_utils.nbdns.zones_generator import ZonesGenerator  # noqa: E402
+
+
+def dnspython_zone_file(zonegen: ZonesGenerator, zone_name: str) -> str:
+    """The zone file as dnspython writes it, from a zone holding the records that output_zones rendered"""
+    zone = zonegen.zones[zone_name]
+    reference = dns.zone.Zone(zone.origin)
+    for labels, rdatasets in zonegen.zone_records(zone_name):
+        for rdtype, covers, prefix, rdatas in rdatasets:
+            rdataset = reference.find_rdataset(dns.name.Name(labels), rdtype, covers, create=True)
+            for text in rdatas:
+                rdata = dns.rdata.from_text(dns.rdataclass.IN, rdtype, text, origin=zone.origin)
+                if rdtype == dns.rdatatype.SOA:
+                    rdata = rdata.replace(serial=zonegen._get_serial(zone))
+                rdataset.add(rdata, int(prefix.split()[0]))
+    f = io.StringIO()
+    reference.to_file(f, sorted=True)
+    return zonegen._zone_header(zone) + f.getvalue() + zonegen._zone_trailer(zone)
+
+
+@click.command()
+@click.option('--scale', default='10k', show_default=True,
+              help='Number of IP addresses, or one of 1k, 10k, 100k, 1m. Other objects scale with it.')
+@click.option('--render-jobs', type=click.IntRange(min=1), default=4, show_default=True,
+              help='Worker processes to render with')
+@click.option('--seed', type=int, default=0, show_default=True, help='Seed for the synthetic data')
+def main(scale: str, render_jobs: int, seed: int):
+    netbox = FakeNetbox(generate(parse_scale(scale), seed))
+    netbox.start()
+    try:
+        with tempfile.TemporaryDirectory(prefix='netbox-utils-bench-') as workdir:
+            config = ConfigParser()
+            config.read_dict({'DEFAULT': {'api': netbox.base_url, 'token': '0123456789abcdef0123456789abcdef01234567'}})
+            api = get_api(config['DEFAULT'])
+            zonegen = zones = host_records = None
+            roots = []
+            for jobs in (None, render_jobs):
+                root = os.path.join(workdir, 'jobs-%s' % (jobs or 0))
+                zonegen = ZonesGenerator(api, 'ns1.example.com.', 'hostmaster.example.com.', 3600, 600, 604800, 3600,
+                                         ['ns1.example.com.', 'ns2.example.com.'], output_root=root)
+                if zones is None:
+                    zonegen.generate_zones(FORWARD_DOMAINS)
+                    zones, host_records = zonegen.zones, zonegen.host_records
+                # The same zones, so that their serials match
+                zonegen.zones, zonegen.host_records = zones, host_records
+                for path in zonegen.output_dirs:
+                    os.makedirs(path)
+                start = time.perf_counter()
+                zonegen.output_zones(render_jobs=jobs)
+                zonegen.publish_zones()
+                print('output_zones, render_jobs=%-4s %8.3fs' % (jobs, time.perf_counter() - start))
+                roots.append(root)
+
+            differs = 0
+            for zone_name in sorted(zones):
+                path = zonegen._get_zone_file(zones[zone_name])
+                expected = dnspython_zone_file(zonegen, zone_name)
+                for root in roots:
+                    rendered_path = os.path.join(root, os.path.relpath(path, zonegen.output_root))
+                    with open(rendered_path) as f:
+                        if f.read() != expected:
+                            print('DIFFERS from dnspython: %s' % rendered_path)
+                            differs += 1
+            print('%d of %d zone files identical to dnspython\'s' % (len(zones) * len(roots) - differs,
+                                                                    len(zones) * len(roots)))
+            if differs:
+                sys.exit(1)
+    finally:
+        netbox.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Compare finding each address's reverse zone with the PrefixIndex in ZonesGenerator against the scan over every reverse
+zone that it replaced, for the /24 zones of an IPv4 aggregate. The scan is timed on a sample of the addresses and
+scaled up, as at 1M addresses it would take many minutes.
+
+    python benchmarks/reverse_lookup.py --addresses 10k --addresses 100k --addresses 1m
+"""
+import ipaddress
+import random
+import sys
+import time
+from typing import Dict, List, Optional
+
+import click
+
+from fixtures import parse_scale
+from run import ROOT
+
+sys.path.insert(0, ROOT)
+
+from netbox_utils.nbdns.zones_generator import ZonesGenerator  # noqa: E402
+from netbox_utils.prefix_index import PrefixIndex  # noqa: E402
+
+
+def scan(reverse_zones: Dict[ipaddress.IPv4Network, str], address: ipaddress.IPv4Address) -> Optional[str]:
+    # How _add_host_records found the reverse zone before the index
+    for supernet, zone_name in reverse_zones.items():
+        if address in supernet:
+            return zone_name
+    return None
+
+
+@click.command()
+@click.option('--aggregate', default='10.0.0.0/12', show_default=True,
+              help='IPv4 aggregate whose /24s are the reverse zones')
+@click.option('--addresses', 'address_counts', multiple=True, default=['10k', '100k', '1m'], show_default=True,
+              help='Number of addresses to look up, or one of 1k, 10k, 100k, 1m. May be repeated.')
+@click.option('--scan-sample', type=click.IntRange(min=1), default=1000, show_default=True,
+              help='Addresses to time the scan on')
+@click.option('--seed', type=int, default=0, show_default=True, help='Seed for the addresses')
+def main(aggregate: str, address_counts: List[str], scan_sample: int, seed: int):
+    zonegen = ZonesGenerator(None, 'ns1.example.com.', 'hostmaster.example.com.', 3600, 600, 604800, 3600,
+                             ['ns1.example.com.'])
+    zonegen.reverse_zones = PrefixIndex()
+    network = ipaddress.IPv4Network(aggregate)
+    reverse_zones = {}
+    for subnet in network.subnets(new_prefix=24):
+        reverse_zones[subnet] = zonegen._create_reverse_zone(subnet)
+    print('%d reverse zones in %s' % (len(reverse_zones), network))
+
+    rand = random.Random(seed)
+    first, size = int(network.network_address), network.num_addresses
+    for count in map(parse_scale, address_counts):
+        addresses = [ipaddress.IPv4Address(first + rand.randrange(size)) for _ in range(count)]
+
+        start = time.perf_counter()
+        found = [zonegen._find_reverse_zone(address) for address in addresses]
+        index_time = time.perf_counter() - start
+
+        sample = addresses[:scan_sample]
+        start = time.perf_counter()
+        scanned = [scan(reverse_zones, address) for address in sample]
+        scan_time = (time.perf_counter() - start) * count / len(sample)
+        if scanned != found[:len(sample)]:
+            print('The index and the scan found different zones', file=sys.stderr)
+            sys.exit(1)
+
+        print('%8d addresses: index %8.3fs  scan %10.1fs%s  (%.0fx)' % (
+            count, index_time, scan_time, '' if len(sample) == count else ' (est.)', scan_time / index_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Compare secrets dump grouping the secrets once by the object they are assigned to against the scan of every secret for
+each device that it replaced, with synthetic devices and secrets already in memory so that only the dump itself is
+timed. The scan is timed on a sample of the devices and scaled up. Both are checked to print the same listing.
+
+    python benchmarks/secrets_grouping.py --devices 2000 --devices 20000 --secrets-per-device 3
+"""
+import io
+import random
+import sys
+import time
+from operator import attrgetter
+from types import SimpleNamespace
+from typing import Any, List, TextIO
+
+import click
+
+from run import ROOT
+
+sys.path.insert(0, ROOT)
+
+from netbox_utils.secrets.dump import _dump  # noqa: E402
+from netbox_utils.secrets.export import TextOutput  # noqa: E402
+
+
+class LoadedFetcher:
+    """Answers the Fetcher.all() calls made by an unfiltered dump from lists already in memory"""
+
+    def __init__(self, devices: List[Any], secrets: List[Any]):
+        self.objects = {'dcim.devices': devices, 'secrets.secrets': secrets, 'virtualization.virtual_machines': []}
+
+    def all(self, name: str, **filters) -> List[Any]:
+        return self.objects[name]
+
+
+def make_objects(device_count: int, secrets_per_device: int, seed: int):
+    rand = random.Random(seed)
+    sites = [SimpleNamespace(name='Site %d' % pos) for pos in range(20)]
+    roles = [SimpleNamespace(name=name) for name in ('Router', 'Switch', 'Server', 'PDU', 'Console')]
+    secret_roles = [SimpleNamespace(name=name) for name in ('Login', 'OOB', 'SNMP')]
+    devices = [SimpleNamespace(id=device_id, name='device%06d' % device_id, site=rand.choice(sites),
+                               device_role=rand.choice(roles), primary_ip6=None,
+                               primary_ip4=SimpleNamespace(address='10.%d.%d.%d/24' % (
+                                   device_id >> 16, (device_id >> 8) & 0xff, device_id & 0xff)))
+               for device_id in range(1, device_count + 1)]
+    secrets = [SimpleNamespace(id=secret_id, name='admin', role=rand.choice(secret_roles),
+                               plaintext='secret%d' % secret_id, assigned_object_type='dcim.device',
+                               assigned_object_id=rand.randint(1, device_count))
+               for secret_id in range(1, device_count * secrets_per_device + 1)]
+    rand.shuffle(secrets)
+    return devices, secrets
+
+
+def scan_dump(devices: List[Any], secrets: List[Any], f: TextIO):
+    # How dump listed each device's secrets before they were grouped
+    devices = sorted(devices, key=attrgetter('site.name', 'device_role.name', 'name'))
+    secrets = sorted(secrets, key=attrgetter('role.name', 'name'))
+    output = TextOutput(f)
+    cursite = None
+    curdevice = None
+    for device in devices:
+        if device.site.name != cursite:
+            output.group('Site', device.site.name)
+            cursite = device.site.name
+        if device.name != curdevice:
+            output.object('Device', 'dcim.device', device)
+            curdevice = device.name
+        output.secrets([x for x in secrets if
+                        x.assigned_object_type == 'dcim.device' and x.assigned_object_id == device.id])
+
+
+@click.command()
+@click.option('--devices', 'device_counts', type=click.IntRange(min=1), multiple=True, default=[2000, 20000],
+              show_default=True, help='Number of devices. May be repeated.')
+@click.option('--secrets-per-device', type=click.IntRange(min=1), default=3, show_default=True,
+              help='Average number of secrets per device')
+@click.option('--scan-sample', type=click.IntRange(min=1), default=500, show_default=True,
+              help='Devices to time the scan on')
+@click.option('--seed', type=int, default=0, show_default=True, help='Seed for the synthetic objects')
+def main(device_counts: List[int], secrets_per_device: int, scan_sample: int, seed: int):
+    for device_count in device_counts:
+        devices, secrets = make_objects(device_count, secrets_per_device, seed)
+
+        grouped = io.StringIO()
+        start = time.perf_counter()
+        _dump(LoadedFetcher(devices, secrets), TextOutput(grouped), (), (), (), ())
+        grouped_time = time.perf_counter() - start
+
+        # The scan over a sample of the devices, with all of the secrets, must list what the grouped dump did
+        sample = devices[:scan_sample]
+        scanned = io.StringIO()
+        start = time.perf_counter()
+        scan_dump(sample, secrets, scanned)
+        scan_time = (time.perf_counter() - start) * len(devices) / len(sample)
+        sampled = io.StringIO()
+        _dump(LoadedFetcher(sample, [secret for secret in secrets if secret.assigned_object_id <= len(sample)]),
+              TextOutput(sampled), (), (), (), ())
+        if scanned.getvalue() != sampled.getvalue():
+            print('The grouped and scanning dumps listed different secrets', file=sys.stderr)
+            sys.exit(1)
+
+        print('%6d devices, %6d secrets: grouped %7.3fs  scan %8.2fs%s  (%.0fx)' % (
+            len(devices), len(secrets), grouped_time, scan_time, '' if len(sample) == len(devices) else ' (est.)',
+            scan_time / grouped_time))
+
+
+if __name__ == '__main__':
+    main()
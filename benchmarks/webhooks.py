@@ -0,0 +1,148 @@
+"""
+Run `dns serve` against a fake Netbox holding synthetic data, send it IP Address webhooks as if from Netbox, and
+report how long each takes to reach the zone files, against a full `dns generate` of the same data.
+
+Finally a new Aggregate is added and its webhook sent, and the run fails unless the rebuild it causes creates the new
+reverse zone and keeps every name changed by the IP Address webhooks. Use --cache to check this with the snapshot
+cache, which the rebuild has to sync again.
+
+    python benchmarks/webhooks.py --scale 100k --changes 20
+"""
+import hashlib
+import hmac
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Any, Dict, Set
+
+import click
+
+from fake_netbox import FakeNetbox
+from fixtures import FORWARD_DOMAINS, generate, parse_scale
+from run import CONFIG, ROOT, _run
+
+SECRET = 'benchmark-webhook-secret'
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _status(port: int) -> Dict[str, Any]:
+    with urllib.request.urlopen('http://127.0.0.1:%d/' % port) as response:
+        return json.load(response)
+
+
+def _send(port: int, event: Dict[str, Any]):
+    body = json.dumps(event).encode()
+    request = urllib.request.Request('http://127.0.0.1:%d/' % port, body, {
+        'Content-Type': 'application/json',
+        'X-Hook-Signature': hmac.new(SECRET.encode(), body, hashlib.sha512).hexdigest(),
+    })
+    with urllib.request.urlopen(request):
+        pass
+
+
+def _wait_for_batch(port: int, batches: int, process: subprocess.Popen, timeout: float = 600.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise click.ClickException('dns serve exited with %d' % process.returncode)
+        try:
+            if _status(port)['batches'] >= batches:
+                return
+        except OSError:
+            pass
+        time.sleep(0.01)
+    raise click.ClickException('dns serve did not apply the changes within %ds' % timeout)
+
+
+def _zone_owners(zones_dir: str) -> Dict[str, Set[str]]:
+    owners = {}
+    for filename in os.listdir(zones_dir):
+        with open(os.path.join(zones_dir, filename)) as f:
+            owners[filename] = {line.split(None, 1)[0] for line in f
+                                if line.strip() and not line.startswith((';', '$'))}
+    return owners
+
+
+@click.command()
+@click.option('--scale', default='10k', show_default=True,
+              help='Number of IP addresses, or one of 1k, 10k, 100k, 1m. Other objects scale with it.')
+@click.option('--changes', type=click.IntRange(min=1), default=10, show_default=True,
+              help='Number of IP Address changes to send, one batch at a time')
+@click.option('--debounce', type=float, default=0.1, show_default=True, help='--debounce for dns serve')
+@click.option('--seed', type=int, default=0, show_default=True, help='Seed for the synthetic data')
+@click.option('--cache', 'use_cache', is_flag=True, help='Run dns serve with the snapshot cache')
+def main(scale: str, changes: int, debounce: float, seed: int, use_cache: bool):
+    checkzone = shutil.which('named-checkzone') or shutil.which('true')
+    data = generate(parse_scale(scale), seed)
+    netbox = FakeNetbox(data)
+    netbox.start()
+    rand = random.Random(seed)
+
+    with tempfile.TemporaryDirectory(prefix='netbox-utils-bench-') as workdir:
+        config = CONFIG % {'api': netbox.base_url, 'forward_domains': ','.join(FORWARD_DOMAINS),
+                           'checkzone': checkzone, 'cache_dir': os.path.join(workdir, 'cache'), 'private_key_file': ''}
+        with open(os.path.join(workdir, 'bench.conf'), 'w') as f:
+            f.write(config.replace('\n[secrets]', 'dns_webhook_secret = %s\n\n[secrets]' % SECRET, 1))
+
+        start = time.perf_counter()
+        _run(workdir, ['dns', 'generate', '--force'])
+        print('dns generate --force        %8.3fs' % (time.perf_counter() - start))
+
+        port = _free_port()
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+        process = subprocess.Popen([sys.executable, '-c', 'import netbox_utils; netbox_utils.cli()', '-c', 'bench.conf']
+                                   + (['--cache'] if use_cache else [])
+                                   + ['dns', 'serve', '--listen', '127.0.0.1:%d' % port, '--debounce', str(debounce)],
+                                   cwd=workdir, env=env, stdout=subprocess.DEVNULL)
+        try:
+            start = time.perf_counter()
+            _wait_for_batch(port, 1, process)
+            print('dns serve startup           %8.3fs' % (time.perf_counter() - start))
+
+            addresses = [obj for obj in data['ipam/ip-addresses'] if obj['dns_name']]
+            latencies = []
+            changed = {}
+            for batch in range(2, changes + 2):
+                obj = rand.choice(addresses)
+                changed[obj['id']] = ('changed%d' % batch, rand.choice(FORWARD_DOMAINS))
+                netbox.update('ipam/ip-addresses', [{'id': obj['id'], 'dns_name': '%s.%s' % changed[obj['id']]}])
+                start = time.perf_counter()
+                _send(port, {'event': 'updated', 'model': 'ipaddress', 'data': obj})
+                _wait_for_batch(port, batch, process)
+                latencies.append(time.perf_counter() - start)
+            print('webhook to zone files       %8.3fs median, %.3fs max (including %.3fs debounce)' % (
+                statistics.median(latencies), max(latencies), debounce))
+
+            aggregate = netbox.create('ipam/aggregates', [{'prefix': '192.0.2.0/24', 'rir': None}])[0]
+            start = time.perf_counter()
+            _send(port, {'event': 'created', 'model': 'aggregate', 'data': aggregate})
+            _wait_for_batch(port, changes + 2, process)
+            print('aggregate rebuild           %8.3fs' % (time.perf_counter() - start))
+
+            owners = _zone_owners(os.path.join(workdir, 'out', 'zones'))
+            if '2.0.192.in-addr.arpa' not in owners:
+                raise click.ClickException('The rebuild did not create the new Aggregate\'s reverse zone')
+            lost = ['%s.%s' % name for name in changed.values() if name[0] not in owners.get(name[1], set())]
+            if lost:
+                raise click.ClickException('The rebuild lost the names changed by webhook: %s' % ', '.join(lost))
+        finally:
+            process.terminate()
+            process.wait()
+            netbox.stop()
+
+
+if __name__ == '__main__':
+    main()
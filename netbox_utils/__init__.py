@@ -1,13 +1,71 @@
+import importlib
 import os
 import sys
-from configparser import ConfigParser
+from configparser import ConfigParser, SectionProxy
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
 
 import click
-import pynetbox
 from click import Context
-from pynetbox.core.api import Api
 
-from netbox_utils import secrets, nbdns, nbip
+from netbox_utils.profile import Profiler
+
+if TYPE_CHECKING:
+    from pynetbox.core.api import Api
+
+# Subcommand groups, only imported when invoked so that startup doesn't pay for dnspython, yaml etc.
+SUBCOMMANDS = {
+    'cache': 'netbox_utils.cache:cache',
+    'dns': 'netbox_utils.nbdns:dns',
+    'ip': 'netbox_utils.nbip:ip',
+    'secrets': 'netbox_utils.secrets:secrets',
+}
+
+
+class LazyGroup(click.Group):
+    """A click group whose subcommands are given as 'module:attribute' and imported on first use"""
+
+    def __init__(self, *args, lazy_subcommands: Optional[Dict[str, str]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_subcommands = lazy_subcommands or {}
+
+    def list_commands(self, ctx: Context) -> List[str]:
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_subcommands))
+
+    def get_command(self, ctx: Context, cmd_name: str) -> Optional[click.Command]:
+        if cmd_name in self.lazy_subcommands and cmd_name not in self.commands:
+            module_name, attr = self.lazy_subcommands[cmd_name].split(':')
+            self.add_command(getattr(importlib.import_module(module_name), attr), cmd_name)
+        return super().get_command(ctx, cmd_name)
+
+    def format_commands(self, ctx: Context, formatter: click.HelpFormatter):
+        # List the lazy subcommands by name without importing them just for --help
+        rows = []
+        for name in self.list_commands(ctx):
+            cmd = self.commands.get(name)
+            if cmd is not None and cmd.hidden:
+                continue
+            rows.append((name, cmd.get_short_help_str(formatter.width - 6 - len(name)) if cmd else ''))
+        if rows:
+            with formatter.section('Commands'):
+                formatter.write_dl(rows)
+
+
+class LazyObj(dict):
+    """Context object whose expensive entries (the API client etc.) are only created when first looked up"""
+
+    def __init__(self):
+        super().__init__()
+        self._factories: Dict[str, Callable[[], Any]] = {}
+
+    def lazy(self, key: str, factory: Callable[[], Any]):
+        self.pop(key, None)
+        self._factories[key] = factory
+
+    def __missing__(self, key: str) -> Any:
+        if key not in self._factories:
+            raise KeyError(key)
+        value = self[key] = self._factories.pop(key)()
+        return value
 
 
 def load_config(config_file) -> ConfigParser:
@@ -36,21 +94,48 @@ def load_config(config_file) -> ConfigParser:
     return ConfigParser()
 
 
-def get_api(config, verbose=False) -> Api:
+def get_api(config, verbose=False, check=False, profiler: Optional['Profiler'] = None) -> 'Api':
+    import pynetbox
+
+    from netbox_utils.session import build_session, print_session_stats
+
     nb = pynetbox.api(config['api'], config['token'],
                       private_key=config['private_key'] if 'private_key' in config else None,
                       private_key_file=config['private_key_file'] if 'private_key_file' in config else None
                       )
+    # Share one tuned, pooled session between pynetbox and our own fetches
+    nb.http_session = build_session(config)
+    if profiler and profiler.enabled:
+        nb.http_session.hooks['response'].append(profiler.record_response)
+    if verbose:
+        click.get_current_context().call_on_close(lambda: print_session_stats(nb.http_session))
 
     # Call the status method to test the connection
-    nb_status = nb.status()
-    if verbose:
-        print("Connected to Netbox version %s at %s" % (nb_status['netbox-version'], config['api']))
+    if check or verbose:
+        nb_status = nb.status()
+        if verbose:
+            print("Connected to Netbox version %s at %s" % (nb_status['netbox-version'], config['api']))
 
     return nb
 
 
-@click.group()
+def get_fetcher(obj: LazyObj, use_cache: bool):
+    from netbox_utils.cache.snapshot import SnapshotStore
+    from netbox_utils.fetch import Fetcher
+
+    config: SectionProxy = obj['config']
+    return Fetcher(obj['netbox'], SnapshotStore(obj['cache_path']) if use_cache else None,
+                   page_size=config.getint('fetch_page_size', 1000),
+                   concurrency=config.getint('fetch_concurrency', 4))
+
+
+def get_cache_path(config: SectionProxy, config_section: str) -> str:
+    from netbox_utils.cache.snapshot import SnapshotStore
+
+    return SnapshotStore.default_path(config_section, config.get('cache_dir'))
+
+
+@click.group(cls=LazyGroup, lazy_subcommands=SUBCOMMANDS)
 @click.pass_context
 @click.option('--config', '-c', 'config_file',
               help='Alternate netbox-utils.conf file (defaults to ~/.config/netbox-utils/netbox-utils.conf)')
@@ -58,8 +143,22 @@ def get_api(config, verbose=False) -> Api:
               help='Alternate config section to use (defaults to DEFAULT)')
 @click.option('--verbose', '-v', 'verbose', is_flag=True,
               help='Verbose connection')
-def cli(ctx: Context, config_file: str, config_section: str, verbose: bool):
-    ctx.ensure_object(dict)
+@click.option('--check', is_flag=True,
+              help='Check the connection to Netbox before running the command')
+@click.option('--cache/--no-cache', 'use_cache', default=None,
+              help='Read Netbox objects from a local snapshot, fetching only what changed since the last run '
+                   '(defaults to the cache config key, or off)')
+@click.option('--profile', 'profile_report', metavar='REPORT.json',
+              help='Write a JSON report of phase timings, HTTP requests and latency per endpoint, and peak memory')
+@click.option('--profile-stats', 'profile_stats', metavar='FILE',
+              help='Also run the command under cProfile and write the stats to FILE, for use with pstats')
+def cli(ctx: Context, config_file: str, config_section: str, verbose: bool, check: bool, use_cache: bool,
+        profile_report: str, profile_stats: str):
+    ctx.obj = obj = LazyObj()
+
+    obj['profiler'] = profiler = Profiler(profile_report, profile_stats)
+    if profiler.enabled:
+        ctx.call_on_close(profiler.close)
 
     root_config = load_config(config_file)
 
@@ -67,10 +166,19 @@ def cli(ctx: Context, config_file: str, config_section: str, verbose: bool):
         print('No config section %s found in config' % config_section, file=sys.stderr)
         sys.exit(1)
 
-    ctx.obj['config'] = root_config[config_section]
+    obj['config'] = root_config[config_section]
+
+    obj['verbose'] = verbose
+    if check or verbose:
+        obj['netbox'] = get_api(obj['config'], verbose, check, profiler)
+    else:
+        # The API client is only created once a command uses it
+        obj.lazy('netbox', lambda: get_api(obj['config'], profiler=profiler))
 
-    ctx.obj['verbose'] = verbose
-    ctx.obj['netbox'] = get_api(ctx.obj['config'], verbose)
+    if use_cache is None:
+        use_cache = obj['config'].getboolean('cache', False)
+    obj.lazy('cache_path', lambda: get_cache_path(obj['config'], config_section))
+    obj.lazy('fetcher', lambda: get_fetcher(obj, use_cache))
 
 
 @cli.command()
@@ -78,6 +186,3 @@ def cli(ctx: Context, config_file: str, config_section: str, verbose: bool):
 def shell(ctx: Context):
     import code
     code.interact(local={'nb': ctx.obj['netbox']}, banner="Netbox API is in 'nb' object", exitmsg='')  # local=locals())
-
-for command in secrets.COMMANDS + nbdns.COMMANDS + nbip.COMMANDS:
-    cli.add_command(command)
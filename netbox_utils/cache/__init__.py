@@ -0,0 +1,40 @@
+import os
+
+import click
+from click import Context
+
+from netbox_utils.cache.snapshot import SnapshotStore
+
+
+@click.group()
+def cache():
+    pass
+
+
+def _get_store(ctx: Context) -> SnapshotStore:
+    fetcher = ctx.obj['fetcher']
+    if fetcher.cache is None:
+        fetcher.cache = SnapshotStore(ctx.obj['cache_path'])
+    return fetcher.cache
+
+
+@cache.command(help='Bring the local snapshot of Netbox objects up to date.')
+@click.option('--full', is_flag=True, help='Discard the snapshot and fetch everything again')
+@click.pass_context
+def sync(ctx: Context, full: bool = False):
+    store = _get_store(ctx)
+    for name in store.ENDPOINTS:
+        updated, deleted = store.sync(ctx.obj['fetcher'], name, full)
+        print('%s: %d updated, %d deleted' % (name, updated, deleted))
+
+
+@cache.command(help='Show what is held in the local snapshot.')
+@click.pass_context
+def stats(ctx: Context):
+    store = _get_store(ctx)
+    print('Snapshot %s (%d KiB)' % (store.path, os.path.getsize(store.path) // 1024))
+    for name, count, synced_at in store.stats():
+        print('  %-32s %8d objects, last synced %s' % (name, count, synced_at or 'never'))
+
+
+COMMANDS = [cache]
@@ -0,0 +1,110 @@
+import json
+import os
+import sqlite3
+from datetime import timedelta
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS objects (
+    endpoint TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (endpoint, id)
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    endpoint TEXT PRIMARY KEY,
+    watermark TEXT NOT NULL,
+    synced_at TEXT NOT NULL
+);
+'''
+
+
+class SnapshotStore:
+    """
+    On-disk SQLite snapshot of Netbox objects.
+
+    The first sync of an endpoint fetches everything. Later syncs only fetch objects with last_updated at or after
+    the previous sync's watermark, then list the ids still present (in brief mode) to drop deleted objects.
+    """
+
+    # Secrets are deliberately not cached, as their decrypted plaintext would be written to disk
+    ENDPOINTS = ['ipam.aggregates', 'ipam.prefixes', 'ipam.ip_addresses', 'dcim.devices',
+                 'virtualization.virtual_machines']
+
+    # Overlap between syncs, to allow for clock skew between the web server's Date header and the database
+    WATERMARK_MARGIN = timedelta(minutes=1)
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self._synced: Set[str] = set()
+
+    @staticmethod
+    def default_path(section: str, cache_dir: Optional[str] = None) -> str:
+        if not cache_dir:
+            cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+            cache_dir = os.path.join(cache_home, 'netbox-utils')
+        return os.path.join(os.path.expanduser(cache_dir), section, 'snapshot.sqlite')
+
+    def handles(self, name: str) -> bool:
+        return name in self.ENDPOINTS
+
+    def _watermark(self, name: str) -> Optional[str]:
+        row = self.db.execute('SELECT watermark FROM sync_state WHERE endpoint = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def _store(self, name: str, objects: Iterator[Dict[str, Any]]) -> int:
+        count = 0
+        for obj in objects:
+            self.db.execute('INSERT OR REPLACE INTO objects (endpoint, id, data) VALUES (?, ?, ?)',
+                            (name, obj['id'], json.dumps(obj, separators=(',', ':'))))
+            count += 1
+        return count
+
+    def sync(self, fetcher, name: str, full: bool = False) -> Tuple[int, int]:
+        """Bring the snapshot of one endpoint up to date. Returns the number of objects updated and deleted."""
+        # Take the watermark before fetching, so anything changed while we fetch is picked up next time
+        server_time = fetcher.server_time(name)
+        watermark = None if full else self._watermark(name)
+        deleted = 0
+
+        with self.db:
+            if watermark is None:
+                self.db.execute('DELETE FROM objects WHERE endpoint = ?', (name,))
+                updated = self._store(name, fetcher.raw(name))
+            else:
+                updated = self._store(name, fetcher.raw(name, last_updated__gte=watermark))
+
+                present = {obj['id'] for obj in fetcher.raw(name, brief=1)}
+                stale = [(name, row[0]) for row in self.db.execute('SELECT id FROM objects WHERE endpoint = ?', (name,))
+                         if row[0] not in present]
+                self.db.executemany('DELETE FROM objects WHERE endpoint = ? AND id = ?', stale)
+                deleted = len(stale)
+
+            self.db.execute('INSERT OR REPLACE INTO sync_state (endpoint, watermark, synced_at) VALUES (?, ?, ?)',
+                            (name, (server_time - self.WATERMARK_MARGIN).isoformat(), server_time.isoformat()))
+
+        self._synced.add(name)
+        return updated, deleted
+
+    def expire(self):
+        """Have values() sync each endpoint again, for a long-running process that reads Netbox more than once"""
+        self._synced.clear()
+
+    def values(self, fetcher, name: str) -> Iterator[Dict[str, Any]]:
+        """Yield the stored objects for an endpoint, syncing it first if that hasn't been done in this run."""
+        if name not in self._synced:
+            self.sync(fetcher, name)
+        for row in self.db.execute('SELECT data FROM objects WHERE endpoint = ? ORDER BY id', (name,)):
+            yield json.loads(row[0])
+
+    def stats(self) -> List[Tuple[str, int, Optional[str]]]:
+        """(endpoint, object count, last sync time) for each cacheable endpoint"""
+        result = []
+        for name in self.ENDPOINTS:
+            count = self.db.execute('SELECT COUNT(*) FROM objects WHERE endpoint = ?', (name,)).fetchone()[0]
+            row = self.db.execute('SELECT synced_at FROM sync_state WHERE endpoint = ?', (name,)).fetchone()
+            result.append((name, count, row[0] if row else None))
+        return result
@@ -0,0 +1,134 @@
+import collections
+import concurrent.futures
+import email.utils
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import requests
+from pynetbox.core.api import Api
+from pynetbox.core.endpoint import Endpoint
+from pynetbox.core.response import Record
+
+
+class Fetcher:
+    """
+    Reads lists of objects from Netbox, either live from the API or from a local snapshot cache.
+
+    Endpoints are named '<app>.<endpoint>' after their pynetbox attributes, e.g. 'ipam.ip_addresses'.
+    """
+
+    def __init__(self, netbox: Api, cache=None, page_size: int = 1000, concurrency: int = 4):
+        self.netbox = netbox
+        self.cache = cache
+        self.page_size = page_size
+        self.concurrency = concurrency
+
+    def endpoint(self, name: str) -> Endpoint:
+        app, endpoint = name.split('.')
+        return getattr(getattr(self.netbox, app), endpoint)
+
+    def _headers(self) -> Dict[str, str]:
+        headers = {'Accept': 'application/json',
+                   'Authorization': 'Token %s' % self.netbox.token}
+        session_key = getattr(self.netbox, 'session_key', None)
+        if session_key:
+            headers['X-Session-Key'] = session_key
+        return headers
+
+    def _get(self, url: str, params: Dict[str, Any] = None) -> requests.Response:
+        response = self.netbox.http_session.get(url, params=params, headers=self._headers())
+        response.raise_for_status()
+        return response
+
+    def server_time(self, name: str) -> datetime:
+        """The Netbox server's current time, taken from the Date header of a minimal request."""
+        response = self._get(self.endpoint(name).url + '/', {'limit': 1, 'brief': 1})
+        server_time = email.utils.parsedate_to_datetime(response.headers['Date'])
+        # HTTP dates are always GMT, but parse to a naive datetime
+        return server_time if server_time.tzinfo else server_time.replace(tzinfo=timezone.utc)
+
+    def _get_page(self, url: str, filters: Dict[str, Any], offset: int, limit: int) -> Dict[str, Any]:
+        return self._get(url, dict(filters, offset=offset, limit=limit)).json()
+
+    def raw(self, name: str, /, **filters) -> Iterator[Dict[str, Any]]:
+        """
+        Yield the JSON objects from a list endpoint in the server's order. The first page gives the total count,
+        then the remaining pages are fetched up to concurrency at a time.
+        """
+        url = self.endpoint(name).url + '/'
+        data = self._get_page(url, filters, 0, self.page_size)
+        yield from data['results']
+        if not data['next']:
+            return
+
+        # Netbox caps the page size at MAX_PAGE_SIZE, so step by what it actually returned
+        limit = len(data['results'])
+        offsets = range(limit, data['count'], limit)
+        if self.concurrency > 1 and len(offsets) > 1:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency)
+            try:
+                pending: Deque[concurrent.futures.Future] = collections.deque()
+                for offset in offsets:
+                    pending.append(executor.submit(self._get_page, url, filters, offset, limit))
+                    # Bound the pages held in memory while the consumer catches up
+                    if len(pending) >= self.concurrency * 2:
+                        data = pending.popleft().result()
+                        yield from data['results']
+                while pending:
+                    data = pending.popleft().result()
+                    yield from data['results']
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
+        else:
+            for offset in offsets:
+                data = self._get_page(url, filters, offset, limit)
+                yield from data['results']
+
+        # Pick up anything created since the count was taken
+        url = data['next']
+        while url:
+            data = self._get(url).json()
+            yield from data['results']
+            url = data['next']
+
+    def bulk_create(self, name: str, objects: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Create several objects in one request to the list endpoint"""
+        response = self.netbox.http_session.post(self.endpoint(name).url + '/', json=objects, headers=self._headers())
+        response.raise_for_status()
+        return response.json()
+
+    def bulk_update(self, name: str, objects: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Patch several objects, each identified by its 'id', in one request to the list endpoint"""
+        response = self.netbox.http_session.patch(self.endpoint(name).url + '/', json=objects, headers=self._headers())
+        response.raise_for_status()
+        return response.json()
+
+    def record(self, name: str, values: Dict[str, Any]) -> Record:
+        endpoint = self.endpoint(name)
+        return endpoint.return_obj(values, self.netbox, endpoint)
+
+    def all(self, name: str, /, **filters) -> Iterator[Record]:
+        """Yield pynetbox records for an endpoint, from the snapshot cache if enabled and the fetch is unfiltered."""
+        if self.cache is not None and not filters and self.cache.handles(name):
+            values = self.cache.values(self, name)
+        else:
+            values = self.raw(name, **filters)
+        for value in values:
+            yield self.record(name, value)
+
+    def fields(self, name: str, fields: Sequence[str], /, hints: Optional[Dict[str, Any]] = None,
+               **filters) -> Iterator[Tuple[Any, ...]]:
+        """
+        Yield just the named fields of each object as a tuple, for bulk reads where building a pynetbox record per
+        object costs more than the work done with it. The server is asked for only those fields, which Netbox 4 and
+        later honour; older versions send whole objects and the rest is dropped here as each page arrives.
+
+        hints are extra filters sent to the API only to cut down what is transferred. They are not applied to objects
+        read from the snapshot cache, so the caller must still check them.
+        """
+        if self.cache is not None and not filters and self.cache.handles(name):
+            values = self.cache.values(self, name)
+        else:
+            values = self.raw(name, fields=','.join(fields), **dict(hints or {}, **filters))
+        for value in values:
+            yield tuple(map(value.get, fields))
@@ -1,9 +1,14 @@
+import ipaddress
 import os
+import sys
+from configparser import SectionProxy
+from typing import Dict, List, Optional
 
 import click
 from click import Context
 
 from netbox_utils.nbdns.zones_generator import ZonesGenerator
+from netbox_utils.profile import Profiler
 
 
 @click.group()
@@ -11,17 +16,81 @@ def dns():
     pass
 
 
+# Config keys that limit the IP Addresses put in the zones, and the Netbox filter each sets
+ADDRESS_FILTER_KEYS = {
+    'dns_vrf': 'vrf_id',
+    'dns_tenant': 'tenant',
+    'dns_status': 'status',
+}
+
+
 @dns.command()
 @click.option('--extra', '-e', 'extra_file',
               help='YAML file containing additional DNS records to add.')
+@click.option('--sparse-reverse', is_flag=True,
+              help='Only create reverse zones that contain at least one PTR record, plus those covering the '
+                   'reverse_always_emit networks in the config.')
+@click.option('--jobs', '-j', 'jobs', type=click.IntRange(min=1),
+              help='Number of zones to verify in parallel (defaults to the number of CPUs)')
+@click.option('--render-jobs', type=click.IntRange(min=1),
+              help='Number of worker processes to render and write the zone files with (by default they are rendered '
+                   'in this process)')
+@click.option('--force', '-f', is_flag=True,
+              help='Rewrite and verify all zones, even those unchanged since the last run')
+@click.option('--swap-dirs', is_flag=True,
+              help='Publish by flipping out/zones and out/signed-zones as symlinks to a new generation directory, '
+                   'instead of replacing changed files one by one')
+@click.option('--per-vrf', is_flag=True,
+              help='Generate a separate set of zones for each VRF (or each one in dns_vrf), so that overlapping '
+                   'addresses are kept apart. The global table goes to out/ as usual and each VRF to out/vrf-<id>/.')
+@click.option('--update', type=click.Choice(['send', 'nsupdate']),
+              help='Also apply just the records changed in each changed zone to the nameserver: send them as RFC 2136 '
+                   'dynamic updates to dns_update_server, or write them as nsupdate scripts to out/nsupdate/')
 @click.pass_context
-def generate(ctx: Context, extra_file=None):
-    if not os.path.exists('out'):
-        os.mkdir('out')
-    if not os.path.exists('out/zones'):
-        os.mkdir('out/zones')
-    if not os.path.exists('out/signed-zones'):
-        os.mkdir('out/signed-zones')
+def generate(ctx: Context, extra_file=None, sparse_reverse: bool = False, jobs: int = None,
+             render_jobs: Optional[int] = None, force: bool = False, swap_dirs: bool = False, per_vrf: bool = False,
+             update: Optional[str] = None):
+    address_filters = get_address_filters(ctx.obj['config'])
+
+    if per_vrf and update and ctx.obj['config'].get('dns_update_server'):
+        # Every VRF's zones have the same names, so their records would be merged on the one server
+        print('--update cannot be used with --per-vrf while dns_update_server is set, as all the VRFs would update the '
+              'same zones on it. Use --update nsupdate without dns_update_server and apply each VRF\'s scripts from '
+              'out/vrf-<id>/nsupdate/ to its own server.', file=sys.stderr)
+        sys.exit(1)
+
+    if per_vrf:
+        vrf_ids = address_filters.get('vrf_id')
+        if not vrf_ids:
+            vrf_ids = ['null'] + [str(vrf_id) for vrf_id, in ctx.obj['fetcher'].fields('ipam.vrfs', ('id',))]
+        for vrf_id in vrf_ids:
+            output_root = 'out' if vrf_id == 'null' else os.path.join('out', 'vrf-%s' % vrf_id)
+            print("VRF %s: %s" % ('global' if vrf_id == 'null' else vrf_id, output_root))
+            generate_zone_set(ctx, output_root, dict(address_filters, vrf_id=[vrf_id]), extra_file, sparse_reverse,
+                              jobs, force, swap_dirs, update, render_jobs)
+    else:
+        generate_zone_set(ctx, 'out', address_filters, extra_file, sparse_reverse, jobs, force, swap_dirs, update,
+                          render_jobs)
+
+
+def get_address_filters(config: SectionProxy) -> Dict[str, List[str]]:
+    address_filters: Dict[str, List[str]] = {}
+    for key, filter_name in ADDRESS_FILTER_KEYS.items():
+        values = [value.strip() for value in config.get(key, '').split(',') if value.strip()]
+        if values:
+            address_filters[filter_name] = values
+    return address_filters
+
+
+def get_always_emit(config: SectionProxy) -> List[ipaddress._BaseNetwork]:
+    return [ipaddress.ip_network(network.strip())
+            for network in config.get('reverse_always_emit', '').split(',') if network.strip()]
+
+
+def make_zones_generator(ctx: Context, output_root: str) -> ZonesGenerator:
+    for path in (output_root, os.path.join(output_root, 'zones'), os.path.join(output_root, 'signed-zones')):
+        if not os.path.exists(path):
+            os.makedirs(path)
 
     zonegen = ZonesGenerator(ctx.obj['netbox'],
                              ctx.obj['config']['soa_mname'],
@@ -31,21 +100,124 @@ def generate(ctx: Context, extra_file=None):
                              int(ctx.obj['config']['soa_expire']),
                              int(ctx.obj['config']['ttl']),
                              ctx.obj['config']['ns_list'].split(','),
+                             ctx.obj['fetcher'],
+                             output_root,
                              )
+    if 'named_checkzone' in ctx.obj['config']:
+        zonegen.checkzone = ctx.obj['config']['named_checkzone']
+    return zonegen
+
+
+def generate_zone_set(ctx: Context, output_root: str, address_filters: Dict[str, List[str]], extra_file: Optional[str],
+                      sparse_reverse: bool, jobs: Optional[int], force: bool, swap_dirs: bool,
+                      update: Optional[str] = None, render_jobs: Optional[int] = None):
+    zonegen = make_zones_generator(ctx, output_root)
+
+    profiler: Profiler = ctx.obj['profiler']
 
     print("Generating zones")
 
-    zonegen.generate_zones(ctx.obj['config']['forward_domains'].split(','))
+    with profiler.phase('generate_zones'):
+        zonegen.generate_zones(ctx.obj['config']['forward_domains'].split(','), sparse_reverse,
+                               get_always_emit(ctx.obj['config']), address_filters)
     if extra_file:
-        zonegen.add_dns_extras(extra_file)
+        with profiler.phase('add_dns_extras'):
+            zonegen.add_dns_extras(extra_file)
 
     print("Outputting zones")
 
-    zonegen.output_zones()
+    with profiler.phase('output_zones'):
+        changed_zones = zonegen.output_zones(force, swap_dirs, render_jobs=render_jobs)
+
+    print("%d of %d zones changed" % (len(changed_zones), len(zonegen.zones)))
+    for zone_name in changed_zones:
+        print("  %s" % zone_name)
 
     print("Verifying zones")
 
-    zonegen.verify_zones()
+    with profiler.phase('verify_zones'):
+        zonegen.verify_zones(jobs, changed_zones)
+    with profiler.phase('publish_zones'):
+        zonegen.publish_zones()
+
+    failed = []
+    if update:
+        from netbox_utils.nbdns.updates import ZoneUpdater
+
+        print("Updating zones")
+        with profiler.phase('update_zones'):
+            updater = ZoneUpdater.from_config(ctx.obj['config'], output_root, update)
+            failed = updater.update_zones(changed_zones,
+                                          lambda zone_name: zonegen.zone_records(zone_name, relativize=False))
+    zonegen.save_manifest(failed)
+    if failed:
+        print('%d zones could not be updated, they will be tried again next time' % len(failed), file=sys.stderr)
+        sys.exit(1)
+
+
+@dns.command()
+@click.option('--listen', '-l', default='127.0.0.1:8053', show_default=True,
+              help='Address and port to listen on for Netbox webhooks')
+@click.option('--extra', '-e', 'extra_file',
+              help='YAML file containing additional DNS records to add.')
+@click.option('--sparse-reverse', is_flag=True,
+              help='Only create reverse zones that contain at least one PTR record, plus those covering the '
+                   'reverse_always_emit networks in the config.')
+@click.option('--jobs', '-j', 'jobs', type=click.IntRange(min=1),
+              help='Number of zones to verify in parallel (defaults to the number of CPUs)')
+@click.option('--render-jobs', type=click.IntRange(min=1),
+              help='Number of worker processes to render and write the zone files with (by default they are rendered '
+                   'in this process)')
+@click.option('--swap-dirs', is_flag=True,
+              help='Publish by flipping out/zones and out/signed-zones as symlinks to a new generation directory, '
+                   'instead of replacing changed files one by one')
+@click.option('--debounce', type=click.FloatRange(min=0), default=2.0, show_default=True,
+              help='Seconds without a webhook before the changes so far are applied')
+@click.option('--max-wait', type=click.FloatRange(min=0), default=30.0, show_default=True,
+              help='Most seconds to hold changes back for while webhooks keep arriving')
+@click.option('--update', type=click.Choice(['send', 'nsupdate']),
+              help='Also apply just the records changed in each changed zone to the nameserver, as for dns generate')
+@click.pass_context
+def serve(ctx: Context, listen: str, extra_file=None, sparse_reverse: bool = False, jobs: int = None,
+          render_jobs: Optional[int] = None, swap_dirs: bool = False, debounce: float = 2.0, max_wait: float = 30.0,
+          update: Optional[str] = None):
+    """
+    Generate the zones, then keep them up to date from Netbox webhooks.
+
+    Send the webhook for IP Address, Prefix and Aggregate changes to http://<listen>/. IP Address changes rewrite just
+    the zones they touch, and Aggregate changes regenerate all zones. Set dns_webhook_secret in the config to the
+    webhook's secret to check its signature.
+    """
+    from netbox_utils.nbdns.serve import ZoneServer, serve as serve_webhooks
+
+    config = ctx.obj['config']
+    host, _, port = listen.rpartition(':')
+    if not host or not port.isdigit():
+        print('Listen address %s is not in the form host:port' % listen, file=sys.stderr)
+        sys.exit(1)
+
+    address_filters = get_address_filters(config)
+
+    def build() -> ZonesGenerator:
+        if ctx.obj['fetcher'].cache is not None:
+            # Rebuilds must see Netbox as it is now, including the changes webhooks have applied since the last one
+            ctx.obj['fetcher'].cache.expire()
+        zonegen = make_zones_generator(ctx, 'out')
+        zonegen.generate_zones(config['forward_domains'].split(','), sparse_reverse, get_always_emit(config),
+                               address_filters, track_hosts=True)
+        if extra_file:
+            zonegen.add_dns_extras(extra_file)
+        return zonegen
+
+    updater = None
+    if update:
+        from netbox_utils.nbdns.updates import ZoneUpdater
+
+        updater = ZoneUpdater.from_config(config, 'out', update)
+
+    server = ZoneServer(build, debounce, max_wait, jobs, swap_dirs, config.get('dns_webhook_secret'), updater,
+                         render_jobs)
+    serve_webhooks(server, host.strip('[]'), int(port))
 
 
 COMMANDS = [dns]
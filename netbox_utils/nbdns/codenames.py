@@ -0,0 +1,70 @@
+import bisect
+import ipaddress
+from typing import Iterable, List, Tuple
+
+
+class CodenameTable:
+    """
+    Two-word hostnames ("word1-word2") for DHCP pool addresses.
+
+    Every ordered pair of two different words is one slot. allocate() gives each pool a run of slots starting at its
+    first address modulo the number of slots, skipping any slots already given to a pool lower in the address space.
+    A host's name therefore depends only on its address and the pools it collides with, so adding, removing or
+    resizing a pool leaves the names in every pool that doesn't collide with it alone.
+    """
+
+    def __init__(self, words: Iterable[str]):
+        # A repeated word would give two slots the same name
+        self.words: List[str] = list(dict.fromkeys(words))
+        if len(self.words) < 2:
+            raise ValueError('At least two different codenames are needed, got %d' % len(self.words))
+        self.capacity = len(self.words) * (len(self.words) - 1)
+        # (first address, last address, first slot) of each run of addresses given consecutive slots, by address
+        self._runs: List[Tuple[int, int, int]] = []
+        self._run_starts: List[int] = []
+
+    @classmethod
+    def from_file(cls, filename: str) -> 'CodenameTable':
+        with open(filename, 'r') as file:
+            return cls(word for word in (line.strip().replace(' ', '') for line in file) if word)
+
+    def allocate(self, pools: List[Tuple[int, int]]):
+        """
+        Give every address in the (first, last) address ranges its own slot, raising ValueError if there are more
+        addresses than slots. Replaces any earlier allocation.
+        """
+        total = sum(last - first + 1 for first, last in pools)
+        if total > self.capacity:
+            raise ValueError('The pools have %d addresses but there are only %d codenames' % (total, self.capacity))
+
+        # Slot ranges given out so far, as sorted and disjoint (first, last) pairs
+        taken: List[Tuple[int, int]] = []
+        runs = []
+        for first, last in sorted(pools):
+            address, slot = first, first % self.capacity
+            while address <= last:
+                pos = bisect.bisect_right(taken, (slot, self.capacity))
+                if pos and taken[pos - 1][1] >= slot:
+                    slot = (taken[pos - 1][1] + 1) % self.capacity
+                    continue
+                free_end = taken[pos][0] - 1 if pos < len(taken) else self.capacity - 1
+                length = min(free_end - slot + 1, last - address + 1)
+                runs.append((address, address + length - 1, slot))
+                bisect.insort(taken, (slot, slot + length - 1))
+                address += length
+                slot = (slot + length) % self.capacity
+
+        runs.sort()
+        self._runs = runs
+        self._run_starts = [run[0] for run in runs]
+
+    def codename(self, address: int) -> str:
+        pos = bisect.bisect_right(self._run_starts, address) - 1
+        if pos < 0 or address > self._runs[pos][1]:
+            raise ValueError('%s is not in a pool given codenames' % ipaddress.ip_address(address))
+        run_first, _, run_slot = self._runs[pos]
+        first, second = divmod(run_slot + address - run_first, len(self.words) - 1)
+        # Skip the pair of a word with itself
+        if second >= first:
+            second += 1
+        return '%s-%s' % (self.words[first], self.words[second])
@@ -0,0 +1,195 @@
+import ipaddress
+from array import array
+from typing import Dict, List, Optional, Set, Tuple
+
+import dns.ipv4
+import dns.ipv6
+import dns.name
+import dns.rdatatype
+
+from netbox_utils.nbdns.render import Records
+
+# Name id of a row whose record has been removed
+_REMOVED = 0xffffffff
+
+_LOW_MASK = (1 << 64) - 1
+
+
+class HostRecords:
+    """
+    The A, AAAA and PTR records of IP Addresses and DHCP pools, kept in columns rather than as dnspython objects.
+
+    Names are interned once, with the forward zone they fall in. Each record is then a row of a name id and an
+    address, which is in the forward zone of its name and the reverse zone of its address, and each zone keeps the
+    row numbers of its records. A zone's records are only built, as render.Records, when it is written.
+
+    As in a dnspython zone, names differing only in case share a node, written with the spelling of its first record,
+    and an address's PTR targets are told apart ignoring case. Each PTR target is otherwise written as it was given.
+    """
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self._names: List[str] = []
+        self._name_zones: List[Optional[str]] = []
+        # The id of the first name seen that is the same ignoring case, for each name
+        self._name_folds = array('I')
+        # Keyed by the absolute name, plus any other spelling of it that it was added with
+        self._name_ids: Dict[str, int] = {}
+        # Keyed by the lowercased absolute name, for names that aren't all lowercase
+        self._mixed_case_ids: Dict[str, int] = {}
+
+        self._row_names = array('I')
+        self._row_versions = array('B')
+        self._row_high = array('Q')
+        self._row_low = array('Q')
+        self._forward_rows: Dict[str, array] = {}
+        self._reverse_rows: Dict[str, array] = {}
+
+    @staticmethod
+    def _name_key(text: str) -> str:
+        return text if text.endswith('.') else text + '.'
+
+    def find_name(self, text: str) -> Optional[int]:
+        return self._name_ids.get(self._name_key(text))
+
+    def add_name(self, name: dns.name.Name, forward_zone: Optional[str], text: Optional[str] = None) -> int:
+        """Intern name, in forward_zone if any, also under the spelling text it was given as. Returns its id."""
+        absolute = name.to_text()
+        name_id = self._name_ids.get(absolute)
+        if name_id is None:
+            name_id = len(self._names)
+            folded = absolute.lower()
+            fold_id = self._mixed_case_ids.get(folded)
+            if folded != absolute:
+                if fold_id is None:
+                    lower_id = self._name_ids.get(folded)
+                    fold_id = self._name_folds[lower_id] if lower_id is not None else name_id
+                    self._mixed_case_ids[folded] = fold_id
+            self._names.append(absolute)
+            self._name_zones.append(forward_zone)
+            self._name_folds.append(name_id if fold_id is None else fold_id)
+            self._name_ids[absolute] = name_id
+        if text is not None and self._name_key(text) != absolute:
+            self._name_ids[self._name_key(text)] = name_id
+        return name_id
+
+    def name_zone(self, name_id: int) -> Optional[str]:
+        return self._name_zones[name_id]
+
+    def add(self, name_id: int, version: int, address: int, reverse_zone: Optional[str]):
+        """Add the A or AAAA record of the name, and the PTR record of the address in reverse_zone if any"""
+        forward_zone = self._name_zones[name_id]
+        if forward_zone is None and reverse_zone is None:
+            return
+        row = len(self._row_names)
+        self._row_names.append(name_id)
+        self._row_versions.append(version)
+        self._row_high.append(address >> 64)
+        self._row_low.append(address & _LOW_MASK)
+        if forward_zone is not None:
+            self._forward_rows.setdefault(forward_zone, array('I')).append(row)
+        if reverse_zone is not None:
+            self._reverse_rows.setdefault(reverse_zone, array('I')).append(row)
+
+    def remove(self, name_id: int, version: int, address: int, reverse_zone: Optional[str]):
+        """Remove the records added by add()"""
+        high, low = address >> 64, address & _LOW_MASK
+        for rows in (self._forward_rows.get(self._name_zones[name_id]), self._reverse_rows.get(reverse_zone)):
+            for row in rows or ():
+                if (self._row_names[row] == name_id and self._row_low[row] == low and self._row_high[row] == high
+                        and self._row_versions[row] == version):
+                    self._row_names[row] = _REMOVED
+
+    def ptr_addresses(self, version: int) -> Set[int]:
+        """The addresses of the given IP version that have a PTR record"""
+        return {(self._row_high[row] << 64) | self._row_low[row]
+                for rows in self._reverse_rows.values() for row in rows
+                if self._row_names[row] != _REMOVED and self._row_versions[row] == version}
+
+    def size(self, zone_name: str) -> int:
+        return len(self._forward_rows.get(zone_name, ())) + len(self._reverse_rows.get(zone_name, ()))
+
+    def _labels(self, name_id: int) -> Tuple[bytes, ...]:
+        text = self._names[name_id]
+        if '\\' in text:
+            return dns.name.from_text(text).labels
+        return tuple(text.encode().split(b'.'))
+
+    def _target_text(self, name_id: int, origin: dns.name.Name, origin_suffix: Optional[str]) -> str:
+        text = self._names[name_id]
+        # Targets are hardly ever inside the zone, so only parse those whose text could be
+        if origin_suffix is not None and text.lower().endswith(origin_suffix):
+            name = dns.name.from_text(text)
+            if name.is_subdomain(origin):
+                return name.relativize(origin).to_text()
+        return text
+
+    @staticmethod
+    def _zone_prefix(origin: dns.name.Name, version: int) -> Tuple[int, int]:
+        """The shift and value of the high bits of every address in the reverse zone at origin"""
+        labels = origin.labels[:len(origin.labels) - 3]
+        bits, base = (8, 10) if version == 4 else (4, 16)
+        value = 0
+        for label in reversed(labels):
+            value = (value << bits) | int(label, base)
+        return (32 if version == 4 else 128) - bits * len(labels), value
+
+    def zone_records(self, zone_name: str, origin: dns.name.Name, relativize: bool = True) -> Records:
+        """The records in the zone, unsorted, with their rdata relative to origin if relativize is set"""
+        row_names, versions, highs, lows = self._row_names, self._row_versions, self._row_high, self._row_low
+        folds = self._name_folds
+        prefixes = {rdtype: '%d IN %s' % (self.ttl, dns.rdatatype.to_text(rdtype))
+                    for rdtype in (dns.rdatatype.A, dns.rdatatype.AAAA, dns.rdatatype.PTR)}
+        depth = len(origin.labels)
+        origin_suffix = origin.to_text().lower() if relativize else None
+        records = []
+
+        # Each name's A and AAAA records, in the order they were added. Names differing only in case share a node,
+        # written with the spelling of its first record.
+        nodes: Dict[int, Dict[int, Dict[str, None]]] = {}
+        owners: Dict[int, int] = {}
+        for row in self._forward_rows.get(zone_name, ()):
+            name_id = row_names[row]
+            if name_id == _REMOVED:
+                continue
+            fold_id = folds[name_id]
+            rdatasets = nodes.get(fold_id)
+            if rdatasets is None:
+                rdatasets = nodes[fold_id] = {}
+                owners[fold_id] = name_id
+            if versions[row] == 4:
+                rdatas = rdatasets.setdefault(dns.rdatatype.A, {})
+                rdatas[dns.ipv4.inet_ntoa(lows[row].to_bytes(4, 'big'))] = None
+            else:
+                rdatas = rdatasets.setdefault(dns.rdatatype.AAAA, {})
+                rdatas[dns.ipv6.inet_ntoa(((highs[row] << 64) | lows[row]).to_bytes(16, 'big'))] = None
+        for fold_id, rdatasets in nodes.items():
+            labels = self._labels(owners[fold_id])
+            records.append((labels[:len(labels) - depth], [(rdtype, 0, prefixes[rdtype], list(rdatas))
+                                                           for rdtype, rdatas in rdatasets.items()]))
+
+        # Each address's PTR targets, keeping the first spelling of names that differ only in case
+        ptrs: Dict[Tuple[int, int, int], Dict[int, int]] = {}
+        for row in self._reverse_rows.get(zone_name, ()):
+            name_id = row_names[row]
+            if name_id != _REMOVED:
+                ptrs.setdefault((versions[row], highs[row], lows[row]), {}).setdefault(folds[name_id], name_id)
+        # The owner names only hold the octets or nibbles below the origin, so the rest must be the origin's
+        zone_prefixes: Dict[int, Tuple[int, int]] = {}
+        for (version, high, low), targets in ptrs.items():
+            if version not in zone_prefixes:
+                zone_prefixes[version] = self._zone_prefix(origin, version)
+            shift, value = zone_prefixes[version]
+            if version == 4:
+                address = low
+                labels = tuple(b'%d' % ((low >> (8 * pos)) & 0xff) for pos in range(7 - depth))
+            else:
+                address = (high << 64) | low
+                labels = tuple(b'%x' % ((address >> (4 * pos)) & 0xf) for pos in range(35 - depth))
+            if address >> shift != value:
+                raise ValueError('%s is not in reverse zone %s' % (
+                    ipaddress.IPv4Address(address) if version == 4 else ipaddress.IPv6Address(address), zone_name))
+            records.append((labels, [(dns.rdatatype.PTR, 0, prefixes[dns.rdatatype.PTR],
+                                      [self._target_text(name_id, origin, origin_suffix)
+                                       for name_id in targets.values()])]))
+        return records
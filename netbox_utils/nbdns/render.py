@@ -0,0 +1,110 @@
+import hashlib
+from typing import List, Optional, Tuple
+
+import dns.name
+import dns.rdata
+import dns.rdataclass
+import dns.rdatatype
+import dns.zone
+
+# A zone's records in a compact, picklable form for rendering in another process: for each node its relative name's
+# labels and rdatasets, each as (rdtype, covers, "ttl class type" text, rdata texts). The SOA's serial is left as 0.
+Records = List[Tuple[Tuple[bytes, ...], List[Tuple[int, int, str, List[str]]]]]
+
+
+def zone_records(zone: dns.zone.Zone, hosts: Optional[Records] = None, relativize: bool = True) -> Records:
+    """
+    The zone's records, together with hosts (e.g. from HostRecords), in DNSSEC canonical order as dns.name.Name sorts.
+    With relativize unset, names in the rdata are written in full.
+    """
+    records = []
+    prefixes = {}
+    text_kw = {'origin': zone.origin, 'relativize': relativize}
+    if hasattr(dns.rdata, 'RdataStyle'):
+        # dnspython 2.8 and later take a prebuilt style, rather than building one for each rdata from the keywords
+        text_kw['style'] = dns.rdata.RdataStyle(origin=zone.origin, relativize=relativize)
+    for name, node in zone.nodes.items():
+        rdatasets = []
+        for rdataset in node.rdatasets:
+            if rdataset.rdtype == dns.rdatatype.SOA:
+                rdatas = [rdata.replace(serial=0) for rdata in rdataset]
+            else:
+                rdatas = rdataset
+            key = (rdataset.ttl, rdataset.rdclass, rdataset.rdtype)
+            if key not in prefixes:
+                prefixes[key] = '%d %s %s' % (rdataset.ttl, dns.rdataclass.to_text(rdataset.rdclass),
+                                              dns.rdatatype.to_text(rdataset.rdtype))
+            rdatasets.append((rdataset.rdtype, rdataset.covers, prefixes[key],
+                              [rdata.to_text(**text_kw) for rdata in rdatas]))
+        records.append((name.labels, rdatasets))
+
+    # The sort is stable, so where a host shares a name with the zone's own records, the zone's come first
+    keyed = [([label.lower() for label in reversed(labels)], labels, rdatasets)
+             for labels, rdatasets in records + (hosts or [])]
+    keyed.sort(key=lambda record: record[0])
+    records = []
+    last_key = None
+    for key, labels, rdatasets in keyed:
+        if key == last_key:
+            records[-1] = (records[-1][0], _merge_rdatasets(records[-1][1], rdatasets))
+        else:
+            records.append((labels, rdatasets))
+        last_key = key
+    return records
+
+
+def _merge_rdatasets(own: List[Tuple[int, int, str, List[str]]],
+                     hosts: List[Tuple[int, int, str, List[str]]]) -> List[Tuple[int, int, str, List[str]]]:
+    # The zone's own records of a type, such as extras, replace host records of that type
+    types = {rdataset[0] for rdataset in own}
+    apex = [rdataset for rdataset in own if rdataset[0] in (dns.rdatatype.SOA, dns.rdatatype.NS)]
+    return apex + [rdataset for rdataset in hosts if rdataset[0] not in types] + [
+        rdataset for rdataset in own if rdataset[0] not in (dns.rdatatype.SOA, dns.rdatatype.NS)]
+
+
+def _with_serial(soa_text: str, serial: int) -> str:
+    mname, rname, _, timers = soa_text.split(' ', 3)
+    return '%s %s %d %s' % (mname, rname, serial, timers)
+
+
+def records_hash(records: Records) -> str:
+    """Hash of the records, which ignores their order within the zone and the SOA serial"""
+    h = hashlib.sha256()
+    for labels, rdatasets in records:
+        name_text = dns.name.Name(labels).to_text()
+        for _, _, prefix, rdatas in sorted(rdatasets, key=lambda r: (r[0], r[1])):
+            for rdata_text in sorted(rdatas):
+                h.update(('%s %s %s\n' % (name_text, prefix, rdata_text)).encode())
+    return h.hexdigest()
+
+
+def render_records(records: Records, serial: int) -> str:
+    """The records as zone file lines, laid out as dns.zone.Zone.to_file(sorted=True) writes them"""
+    lines = []
+    for labels, rdatasets in records:
+        if not rdatasets:
+            lines.append('\n')
+            continue
+        name_text = dns.name.Name(labels).to_text()
+        for rdtype, _, prefix, rdatas in rdatasets:
+            for rdata_text in rdatas:
+                if rdtype == dns.rdatatype.SOA:
+                    rdata_text = _with_serial(rdata_text, serial)
+                lines.append('%s %s %s\n' % (name_text, prefix, rdata_text))
+    return ''.join(lines)
+
+
+def render_zone_file(records: Records, header: str, trailer: str, path: str, serial: int,
+                     old_serial: Optional[int] = None, old_hash: Optional[str] = None) -> Tuple[str, int, bool]:
+    """
+    Write the zone to path unless its records still hash to old_hash, bumping the serial past old_serial. Returns the
+    hash, the serial and whether the file was written. Runs in the worker processes of ZonesGenerator.output_zones.
+    """
+    zone_hash = records_hash(records)
+    if old_serial is not None:
+        if zone_hash == old_hash:
+            return zone_hash, old_serial, False
+        serial = max(serial, old_serial + 1)
+    with open(path, 'w') as f:
+        f.write(header + render_records(records, serial) + trailer)
+    return zone_hash, serial, True
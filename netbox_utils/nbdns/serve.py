@@ -0,0 +1,205 @@
+import hashlib
+import hmac
+import ipaddress
+import json
+import sys
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from netbox_utils.nbdns.updates import ZoneUpdater
+from netbox_utils.nbdns.zones_generator import ZonesGenerator
+
+# Webhook models that decide which zones exist, so a change to one rebuilds the zones from Netbox
+REBUILD_MODELS = {'aggregate'}
+# Models that no zone records are built from, accepted so that one webhook can cover all of the IPAM models
+IGNORED_MODELS = {'prefix'}
+
+
+class ZoneServer:
+    """
+    Keeps generated zones in memory and applies Netbox webhook events to them.
+
+    Events are queued as they arrive and applied in a batch once none have arrived for debounce seconds, or at most
+    max_wait seconds after the first, so that a bulk edit in Netbox leads to a single rewrite. IP Address events are
+    applied to the zones holding their records, and only those zones are written and checked. Aggregate events
+    rebuild all of the zones from Netbox. If a batch fails, the zones it touched are written with the next one, and a
+    failed rebuild keeps the current zones and is tried again with the next batch.
+    """
+
+    def __init__(self, build: Callable[[], ZonesGenerator], debounce: float = 2.0, max_wait: float = 30.0,
+                 jobs: Optional[int] = None, swap_dirs: bool = False, secret: Optional[str] = None,
+                 updater: Optional[ZoneUpdater] = None, render_jobs: Optional[int] = None):
+        self.build = build
+        self.debounce = debounce
+        self.max_wait = max_wait
+        self.jobs = jobs
+        self.swap_dirs = swap_dirs
+        self.secret = secret
+        self.updater = updater
+        self.render_jobs = render_jobs
+        self.zonegen: Optional[ZonesGenerator] = None
+        self.batches = 0
+        self.last_batch: Optional[float] = None
+        self._events: List[Dict[str, Any]] = []
+        self._last_event = 0.0
+        self._cond = threading.Condition()
+        # Zones that failed checking or weren't written, written again with the next batch
+        self._failed: Set[str] = set()
+        self._rebuild_pending = False
+
+    def check_signature(self, body: bytes, signature: Optional[str]) -> bool:
+        if not self.secret:
+            return True
+        expected = hmac.new(self.secret.encode(), body, hashlib.sha512).hexdigest()
+        return signature is not None and hmac.compare_digest(expected, signature)
+
+    def submit(self, event: Dict[str, Any]):
+        with self._cond:
+            self._events.append(event)
+            self._last_event = time.monotonic()
+            self._cond.notify()
+
+    def status(self) -> Dict[str, Any]:
+        with self._cond:
+            pending = len(self._events)
+        return {'ready': self.zonegen is not None, 'batches': self.batches, 'pending': pending,
+                'zones': len(self.zonegen.zones) if self.zonegen else 0, 'last_batch': self.last_batch,
+                'failed': sorted(self._failed), 'rebuild_pending': self._rebuild_pending}
+
+    def _next_batch(self) -> List[Dict[str, Any]]:
+        with self._cond:
+            while not self._events:
+                self._cond.wait()
+            deadline = time.monotonic() + self.max_wait
+            while True:
+                wait = min(self._last_event + self.debounce, deadline) - time.monotonic()
+                if wait <= 0:
+                    break
+                self._cond.wait(wait)
+            events, self._events = self._events, []
+        return events
+
+    def _publish(self, zone_names: Optional[List[str]] = None):
+        changed_zones = self.zonegen.output_zones(swap_dirs=self.swap_dirs, zone_names=zone_names,
+                                                   render_jobs=self.render_jobs)
+        print("%d zones changed" % len(changed_zones))
+        for zone_name in changed_zones:
+            print("  %s" % zone_name)
+        failed = self.zonegen.check_zones(self.jobs, changed_zones) if changed_zones else []
+        if failed:
+            # Nothing is published, so that named never sees a zone that failed or half of a change
+            self.zonegen.discard_zones()
+            print('Validation failed for %s, none of the changed zones were published and they will be written again '
+                  'with the next change' % ', '.join(failed), file=sys.stderr)
+            failed = changed_zones
+        else:
+            self.zonegen.publish_zones()
+            if self.updater:
+                failed = self.updater.update_zones(
+                    changed_zones, lambda zone_name: self.zonegen.zone_records(zone_name, relativize=False))
+        self.zonegen.save_manifest(failed)
+        self._failed = set(failed)
+        self.batches += 1
+        self.last_batch = time.time()
+
+    def rebuild(self):
+        print("Generating zones")
+        started = time.time()
+        # Until this succeeds, the current zones are kept and each batch tries again
+        self._rebuild_pending = True
+        self.zonegen = self.build()
+        print("Generated %d zones (%.1fs)" % (len(self.zonegen.zones), time.time() - started))
+        self._publish()
+        self._rebuild_pending = False
+
+    def apply(self, events: List[Dict[str, Any]]):
+        models = [event['model'] for event in events]
+        print("Applying %d events (%s)" % (len(events), ', '.join('%d %s' % (models.count(model), model)
+                                                                  for model in sorted(set(models)))))
+        if self._rebuild_pending or REBUILD_MODELS.intersection(models):
+            self.rebuild()
+            return
+
+        for event in events:
+            if event['model'] == 'ipaddress':
+                self._failed |= self.zonegen.update_host(event['data'], deleted=event['event'] == 'deleted')
+        self._publish(sorted(self._failed))
+
+    def run(self):
+        self.rebuild()
+        while True:
+            events = self._next_batch()
+            try:
+                self.apply(events)
+            except (Exception, SystemExit):
+                print('Applying %d events failed:' % len(events), file=sys.stderr)
+                traceback.print_exc()
+
+
+def _parse_event(body: bytes) -> Tuple[Optional[Dict[str, Any]], str]:
+    """Return the webhook event in body, or None and why it was refused"""
+    try:
+        event = json.loads(body)
+    except ValueError as e:
+        return None, 'Invalid JSON: %s' % e
+    if not isinstance(event, dict) or not isinstance(event.get('data'), dict) or 'id' not in event['data']:
+        return None, 'Not a Netbox webhook'
+    if event.get('event') not in ('created', 'updated', 'deleted'):
+        return None, 'Unknown event %s' % event.get('event')
+    if event.get('model') == 'ipaddress':
+        try:
+            ipaddress.ip_interface(event['data'].get('address'))
+        except ValueError:
+            return None, 'IP Address without a valid address'
+    return event, ''
+
+
+def make_handler(server: ZoneServer):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, code: int, body: Dict[str, Any]):
+            content = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def do_GET(self):
+            self._send(200, server.status())
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if not server.check_signature(body, self.headers.get('X-Hook-Signature')):
+                return self._send(403, {'detail': 'Invalid signature'})
+            event, error = _parse_event(body)
+            if event is None:
+                return self._send(400, {'detail': error})
+            if event.get('model') in IGNORED_MODELS:
+                return self._send(200, {'detail': 'Ignored'})
+            if event.get('model') != 'ipaddress' and event.get('model') not in REBUILD_MODELS:
+                return self._send(400, {'detail': 'Unsupported model %s' % event.get('model')})
+            server.submit(event)
+            self._send(202, {'detail': 'Queued'})
+
+    return Handler
+
+
+def serve(server: ZoneServer, host: str, port: int):
+    """Listen for webhooks in the background and apply them until interrupted"""
+    httpd = ThreadingHTTPServer((host, port), make_handler(server))
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    print("Listening for Netbox webhooks on %s:%d" % httpd.server_address[:2])
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
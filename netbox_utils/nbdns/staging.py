@@ -0,0 +1,120 @@
+import itertools
+import os
+import shutil
+import time
+from typing import Dict, List
+
+# Numbers the StagedOutputs of this process, as several can be created within the same second
+_generations = itertools.count()
+
+
+class StagedOutput:
+    """
+    Collects rendered zone files in a staging directory and publishes them atomically, so that named never sees a
+    half-written file.
+
+    By default each staged file is moved over its target with os.replace(). With swap_dirs, each of the output
+    directories is instead a symlink to a generation directory; a new generation is populated (hard-linking the
+    unchanged files from the current one) and the symlink is flipped in a single rename.
+    """
+
+    def __init__(self, output_dirs: List[str], root: str = 'out', swap_dirs: bool = False):
+        self.output_dirs = [os.path.normpath(d) for d in output_dirs]
+        self.root = root
+        self.swap_dirs = swap_dirs
+        self._generation = '%d.%d.%d' % (time.time(), os.getpid(), next(_generations))
+        self._staging_dir = os.path.join(root, '.staging-%s' % self._generation)
+        self._staged: Dict[str, str] = {}
+
+    def _staged_path(self, path: str) -> str:
+        out_dir, filename = os.path.split(os.path.normpath(path))
+        if out_dir not in self.output_dirs:
+            raise ValueError('%s is not in one of the output directories %s' % (path, ', '.join(self.output_dirs)))
+        if self.swap_dirs:
+            return os.path.join('%s.%s' % (out_dir, self._generation), filename)
+        return os.path.join(self._staging_dir, os.path.basename(out_dir), filename)
+
+    def staging_path(self, path: str) -> str:
+        """Where to write the new content of path, before calling add_staged(path)"""
+        staged_path = self._staged_path(path)
+        os.makedirs(os.path.dirname(staged_path), exist_ok=True)
+        return staged_path
+
+    def add_staged(self, path: str):
+        self._staged[os.path.normpath(path)] = self._staged_path(path)
+
+    def staged_file(self, path: str) -> str:
+        """The file holding the new content of path if it has been staged, otherwise path itself"""
+        return self._staged.get(os.path.normpath(path), path)
+
+    def _fsync_all(self):
+        # Flush everything in one pass after writing rather than after each file
+        for staged_path in self._staged.values():
+            fd = os.open(staged_path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        for staged_dir in {os.path.dirname(p) for p in self._staged.values()}:
+            self._fsync_dir(staged_dir)
+
+    def _fsync_dir(self, path: str):
+        if os.name == 'nt':
+            return
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def publish(self):
+        self._fsync_all()
+        if self.swap_dirs:
+            for out_dir in self.output_dirs:
+                self._swap_dir(out_dir)
+        else:
+            for path, staged_path in self._staged.items():
+                os.replace(staged_path, path)
+            for out_dir in {os.path.dirname(p) for p in self._staged}:
+                self._fsync_dir(out_dir)
+            shutil.rmtree(self._staging_dir, ignore_errors=True)
+        self._staged = {}
+
+    def discard(self):
+        """Remove the staged files without publishing them, leaving the output directories as they were"""
+        if self.swap_dirs:
+            for out_dir in self.output_dirs:
+                shutil.rmtree('%s.%s' % (out_dir, self._generation), ignore_errors=True)
+        else:
+            shutil.rmtree(self._staging_dir, ignore_errors=True)
+        self._staged = {}
+
+    def _swap_dir(self, out_dir: str):
+        new_dir = '%s.%s' % (out_dir, self._generation)
+        os.makedirs(new_dir, exist_ok=True)
+
+        old_dir = None
+        if os.path.islink(out_dir):
+            old_dir = os.path.join(os.path.dirname(out_dir), os.readlink(out_dir))
+        elif os.path.isdir(out_dir):
+            # First run in this mode: move the plain directory aside so it can become a symlink
+            old_dir = '%s.%s' % (out_dir, 'initial')
+            os.rename(out_dir, old_dir)
+
+        if old_dir:
+            for filename in os.listdir(old_dir):
+                new_path = os.path.join(new_dir, filename)
+                if not os.path.exists(new_path):
+                    try:
+                        os.link(os.path.join(old_dir, filename), new_path)
+                    except OSError:
+                        shutil.copy2(os.path.join(old_dir, filename), new_path)
+            self._fsync_dir(new_dir)
+
+        temp_link = '%s.%s.link' % (out_dir, self._generation)
+        os.symlink(os.path.basename(new_dir), temp_link)
+        os.replace(temp_link, out_dir)
+        self._fsync_dir(os.path.dirname(out_dir) or '.')
+
+        if old_dir and os.path.realpath(old_dir) != os.path.realpath(new_dir):
+            shutil.rmtree(old_dir, ignore_errors=True)
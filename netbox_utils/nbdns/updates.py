@@ -0,0 +1,168 @@
+import os
+import sys
+from typing import Callable, List, Optional, Set, TextIO, Tuple
+
+import dns.exception
+import dns.name
+import dns.query
+import dns.rcode
+import dns.rdatatype
+import dns.tsigkeyring
+import dns.update
+
+from netbox_utils.nbdns.render import Records
+
+
+def record_lines(origin: dns.name.Name, records: Records) -> Set[str]:
+    """
+    Each of the zone's records, as built with relativize unset, as a "name ttl class type rdata" line with absolute
+    names, leaving out the SOA, whose serial the server maintains. These lines are what is compared, stored and
+    written to nsupdate scripts.
+    """
+    lines = set()
+    for labels, rdatasets in records:
+        name_text = dns.name.Name(labels + origin.labels).to_text()
+        for rdtype, _, prefix, rdatas in rdatasets:
+            if rdtype != dns.rdatatype.SOA:
+                lines.update('%s %s %s' % (name_text, prefix, rdata_text) for rdata_text in rdatas)
+    return lines
+
+
+def read_records(f: TextIO) -> Set[str]:
+    """Read record lines as written by ZoneUpdater or printed by dig axfr, with absolute names and one per line"""
+    records = set()
+    for line in f:
+        fields = line.split(';')[0].split()
+        if fields and not fields[0].startswith('$') and fields[3:4] != ['SOA']:
+            records.add(' '.join(fields))
+    return records
+
+
+class ZoneUpdater:
+    """
+    Applies generated zones to a nameserver as RFC 2136 dynamic updates holding only the records that changed, or
+    writes them as nsupdate scripts, instead of having it reload whole zone files.
+
+    Changes are worked out against the records of each zone as last sent, kept in base_dir. A zone with none there is
+    compared against an empty zone, so its first update only adds records; put its records there (e.g. from dig axfr)
+    to have those that are no longer in Netbox deleted as well.
+    """
+
+    def __init__(self, base_dir: str, server: Optional[str] = None, port: int = 53, keyring=None,
+                 keyname: Optional[str] = None, keyalgorithm: str = 'hmac-sha256', timeout: float = 10.0,
+                 script_dir: Optional[str] = None, max_changes: int = 1000):
+        self.base_dir = base_dir
+        self.server = server
+        self.port = port
+        self.keyring = keyring
+        self.keyname = dns.name.from_text(keyname) if keyname else None
+        self.keyalgorithm = keyalgorithm
+        self.timeout = timeout
+        self.script_dir = script_dir
+        # Records per update message or nsupdate send, so that each fits in a TCP DNS message
+        self.max_changes = max_changes
+
+    @classmethod
+    def from_config(cls, config, output_root: str, mode: str) -> 'ZoneUpdater':
+        """Build an updater for mode 'send' or 'nsupdate' from the dns_update_* config keys"""
+        server = config.get('dns_update_server')
+        port = 53
+        if server:
+            host, _, port_text = server.rpartition(':')
+            # A bare IPv6 address has colons but no port
+            if host and port_text.isdigit() and ':' not in host:
+                server, port = host, int(port_text)
+        if mode == 'send' and not server:
+            print('dns_update_server must be set in the config to send updates', file=sys.stderr)
+            sys.exit(1)
+
+        keyring = keyname = None
+        if config.get('dns_update_key_name'):
+            if not config.get('dns_update_key_secret'):
+                print('dns_update_key_secret must be set along with dns_update_key_name', file=sys.stderr)
+                sys.exit(1)
+            keyname = config['dns_update_key_name']
+            keyring = dns.tsigkeyring.from_text({keyname: config['dns_update_key_secret']})
+
+        return cls(os.path.join(output_root, 'updates'), server, port, keyring, keyname,
+                   config.get('dns_update_key_algorithm', 'hmac-sha256'), config.getfloat('dns_update_timeout', 10.0),
+                   os.path.join(output_root, 'nsupdate') if mode == 'nsupdate' else None)
+
+    def _base_file(self, origin: dns.name.Name) -> str:
+        return os.path.join(self.base_dir, origin.to_text(omit_final_dot=True))
+
+    def _load_base(self, origin: dns.name.Name) -> Set[str]:
+        base_file = self._base_file(origin)
+        if not os.path.exists(base_file):
+            return set()
+        with open(base_file, 'r') as f:
+            return read_records(f)
+
+    def _save_base(self, origin: dns.name.Name, records: Set[str]):
+        os.makedirs(self.base_dir, exist_ok=True)
+        base_file = self._base_file(origin)
+        with open(base_file + '.tmp', 'w') as f:
+            f.writelines('%s\n' % record for record in sorted(records))
+        os.replace(base_file + '.tmp', base_file)
+
+    def _chunks(self, changes: List[Tuple[str, str]]) -> List[List[Tuple[str, str]]]:
+        return [changes[pos:pos + self.max_changes] for pos in range(0, len(changes), self.max_changes)]
+
+    def _send(self, origin: dns.name.Name, changes: List[Tuple[str, str]]):
+        for chunk in self._chunks(changes):
+            update = dns.update.UpdateMessage(origin, keyring=self.keyring, keyname=self.keyname,
+                                              keyalgorithm=self.keyalgorithm)
+            for action, record in chunk:
+                name, ttl, _, rdtype, rdata = record.split(None, 4)
+                if action == 'delete':
+                    update.delete(name, rdtype, rdata)
+                else:
+                    update.add(name, int(ttl), rdtype, rdata)
+            response = dns.query.tcp(update, self.server, timeout=self.timeout, port=self.port)
+            if response.rcode() != dns.rcode.NOERROR:
+                raise RuntimeError('server answered %s' % dns.rcode.to_text(response.rcode()))
+
+    def _write_script(self, origin: dns.name.Name, changes: List[Tuple[str, str]]):
+        os.makedirs(self.script_dir, exist_ok=True)
+        zone_name = origin.to_text(omit_final_dot=True)
+        with open(os.path.join(self.script_dir, zone_name + '.nsupdate'), 'w') as f:
+            for chunk in self._chunks(changes):
+                if self.server:
+                    f.write('server %s %d\n' % (self.server, self.port))
+                f.write('zone %s\n' % origin)
+                f.writelines('update %s %s\n' % change for change in chunk)
+                f.write('send\n')
+
+    def update_zones(self, zone_names: List[str], zone_records: Callable[[str], Records]) -> List[str]:
+        """
+        Send or write the changes to each zone since it was last sent, and return the names of the zones that failed.
+        zone_records gives the records of a zone, with names in full. If the server can't be reached, the rest are not
+        tried.
+        """
+        failed = []
+        for pos, zone_name in enumerate(zone_names):
+            origin = dns.name.from_text(zone_name)
+            records = record_lines(origin, zone_records(zone_name))
+            base = self._load_base(origin)
+            # Deletions first, so that a record whose TTL changed is deleted and then added back
+            changes = [('delete', record) for record in sorted(base - records)]
+            changes += [('add', record) for record in sorted(records - base)]
+            if changes:
+                try:
+                    if self.script_dir:
+                        self._write_script(origin, changes)
+                    else:
+                        self._send(origin, changes)
+                except (OSError, dns.exception.Timeout) as e:
+                    print('Update of %s failed, not trying the remaining %d zones: %s' % (
+                        zone_name, len(zone_names) - pos - 1, e), file=sys.stderr)
+                    failed += zone_names[pos:]
+                    break
+                except (dns.exception.DNSException, RuntimeError) as e:
+                    print('Update of %s failed: %s' % (zone_name, e), file=sys.stderr)
+                    failed.append(zone_name)
+                    continue
+                deleted = len(base - records)
+                print('  %s: %d deleted, %d added' % (zone_name, deleted, len(changes) - deleted))
+            self._save_base(origin, records)
+        return failed
@@ -1,29 +1,55 @@
+import concurrent.futures
 import ipaddress
+import json
 import os
+import subprocess
 import sys
 import time
 from configparser import ConfigParser
-from typing import Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
 
 import dns
+import dns.rdataset
 import dns.rdtypes
 import dns.rdtypes.ANY
 import dns.rdtypes.ANY.NS
-import dns.rdtypes.ANY.PTR
-import dns.rdtypes.IN
-import dns.rdtypes.IN.A
-import dns.rdtypes.IN.AAAA
 import dns.reversename
 import dns.zone
 import yaml
 from pynetbox.core.api import Api
 
+from netbox_utils.fetch import Fetcher
+from netbox_utils.nbdns import render
+from netbox_utils.nbdns.codenames import CodenameTable
+from netbox_utils.nbdns.host_records import HostRecords
+from netbox_utils.nbdns.staging import StagedOutput
+from netbox_utils.prefix_index import PrefixIndex
+
+
+def _filter_value(value: Any, attr: str) -> str:
+    # Nested objects are matched on one attribute, and a missing one as 'null' as in the Netbox API
+    if value is None:
+        return 'null'
+    return str(value[attr]) if isinstance(value, dict) else str(value)
+
 
 class ZonesGenerator:
-    # All zones including reverse
-    zones: Dict[str, dns.zone.Zone] = {}
-    # Reverse only
-    reverse_zones: Dict[ipaddress._BaseNetwork, dns.zone.Zone]
+    # Netbox filters that can narrow down the IP Addresses put in the zones, and the field and nested attribute each
+    # one matches
+    ADDRESS_FILTERS = {
+        'vrf_id': ('vrf', 'id'),
+        'tenant': ('tenant', 'slug'),
+        'status': ('status', 'value'),
+    }
+
+    # All zones including reverse. They hold the SOA, NS and extra records, and host_records the rest.
+    zones: Dict[str, dns.zone.Zone]
+    # Reverse only, by zone name
+    reverse_zones: PrefixIndex[Optional[str]]
+    # Forward only, zone names keyed by origin for suffix lookups
+    forward_zones: Dict[dns.name.Name, str]
+    # The A, AAAA and PTR records of IP Addresses and DHCP pools
+    host_records: HostRecords
 
     _soa_mname: str
     _soa_rname: str
@@ -33,6 +59,29 @@ class ZonesGenerator:
     _ttl: int
     _ns_list: List[str]
 
+    # Zone checker, run as "<checkzone> <zone> <file>" and expected to exit 0 for a valid zone
+    checkzone: str = '/usr/sbin/named-checkzone'
+
+    EDIT_WARNING = (";\n"
+                    "; DO NOT EDIT THIS FILE!\n"
+                    "; This file is automatically generated and changes will be lost next time it is built.\n")
+
+    # Everything is written under output_root. The manifest holds the hashes and serials of the zones last written,
+    # used to skip rewriting unchanged zones.
+    output_root: str
+    manifest_file: str
+    output_dirs: List[str]
+    changed_zones: List[str]
+    _manifest: Dict[str, Dict[str, Any]]
+    # The zone files written by output_zones, until they are published or discarded
+    _output: Optional[StagedOutput] = None
+
+    # With track_hosts, the address and name put in the zones for each IP Address id, and the number of ids giving
+    # each (address, name), so that update_host() can later apply changes to single IP Addresses
+    address_filters: Dict[str, List[str]]
+    hosts: Optional[Dict[int, Tuple[ipaddress._BaseAddress, str]]] = None
+    _host_refs: Dict[Tuple[ipaddress._BaseAddress, str], int]
+
     def __init__(self, netbox: Api,
                  soa_mname: str,
                  soa_rname: str,
@@ -41,8 +90,15 @@ class ZonesGenerator:
                  soa_expire: int,
                  ttl: int,
                  ns_list: List[str],
+                 fetcher: Optional[Fetcher] = None,
+                 output_root: str = 'out',
                  ):
         self.netbox = netbox
+        self.fetcher = fetcher or Fetcher(netbox)
+        self.zones = {}
+        self.output_root = output_root
+        self.manifest_file = os.path.join(output_root, 'zones-manifest.json')
+        self.output_dirs = [os.path.join(output_root, 'zones'), os.path.join(output_root, 'signed-zones')]
         self._soa_mname = soa_mname
         self._soa_rname = soa_rname
         self._soa_refresh = soa_refresh
@@ -83,114 +139,335 @@ class ZonesGenerator:
         for ns in self._ns_list:
             ns_rdataset.add(dns.rdtypes.ANY.NS.NS(dns.rdataclass.IN, dns.rdatatype.NS, ns), self._ttl)
 
-    def generate_zones(self, forward_domains: List[str]):
-        self.reverse_zones = {}
-        aggregates = self.netbox.ipam.aggregates.all()
-        for aggregate in aggregates:
-            supernet: ipaddress._BaseNetwork = ipaddress.ip_network(aggregate)
-            if supernet.version == 4:
-                for subnet in supernet.subnets(new_prefix=24):
-                    rev_zone_name = str(self._get_rev_zone_for_ipv4(subnet))
-                    zone = dns.zone.Zone(rev_zone_name)
-                    self._add_soa_and_ns(zone)
-                    self.zones[rev_zone_name] = zone
-                    self.reverse_zones[subnet] = zone
-            elif supernet.version == 6:
-                rev_zone_name = str(self._get_rev_zone_for_ipv6(supernet))
-                zone = dns.zone.Zone(rev_zone_name)
-                self._add_soa_and_ns(zone)
-                self.zones[rev_zone_name] = zone
-                self.reverse_zones[supernet] = zone
-
-        for zone_name in forward_domains: #self.FWD_DOMAINS:
-            zone = dns.zone.Zone(zone_name + '.')
-            self._add_soa_and_ns(zone)
-            self.zones[zone_name + '.'] = zone
-
-        addresses = self.netbox.ipam.ip_addresses.all()
-        for nb_address in addresses:
-            dns_name = nb_address.dns_name
-            if dns_name:
-                address: ipaddress._BaseAddress = ipaddress.ip_interface(nb_address.address).ip
-                self._add_host_records(address, dns_name)
-
-    def _add_host_records(self, address: ipaddress._BaseAddress, dns_name: str):
-        name: dns.name.Name = dns.name.from_text(dns_name)
-        forward_zone = None
-        for zone in self.zones.values():
-            if name.is_subdomain(zone.origin):
-                forward_zone = zone
-        if forward_zone:
-            record_type = dns.rdatatype.A if address.version == 4 else dns.rdatatype.AAAA
-            forward_rdataset = forward_zone.find_rdataset(name, record_type, create=True)
-
+    def _create_zone(self, zone_name: str) -> dns.zone.Zone:
+        zone = dns.zone.Zone(zone_name)
+        self._add_soa_and_ns(zone)
+        self.zones[zone_name] = zone
+        return zone
+
+    @staticmethod
+    def _reverse_zone_networks(network: ipaddress._BaseNetwork) -> Iterator[ipaddress._BaseNetwork]:
+        """
+        The networks whose reverse zones together cover network: the /24s for IPv4, and for IPv6 the network split on
+        the next nibble boundary, as a zone's owner names can only hold whole octets or nibbles of the address
+        """
+        if network.version == 4:
+            if network.prefixlen > 24:
+                return iter([network.supernet(new_prefix=24)])
+            return network.subnets(new_prefix=24)
+        return network.subnets(new_prefix=-(-network.prefixlen // 4) * 4)
+
+    def _create_reverse_zone(self, network: ipaddress._BaseNetwork) -> str:
+        if network.version == 4:
+            zone_name = str(self._get_rev_zone_for_ipv4(network))
+        else:
+            zone_name = str(self._get_rev_zone_for_ipv6(network))
+        self._create_zone(zone_name)
+        self.reverse_zones.insert(network, zone_name)
+        return zone_name
+
+    def _find_reverse_zone(self, address: ipaddress._BaseAddress, create: bool = True) -> Optional[str]:
+        """The reverse zone of address. Without create, None where sparse mode has not created its zone yet."""
+        match = self.reverse_zones.lookup_network(address)
+        if match is None:
+            return None
+        network, zone_name = match
+        if zone_name is None and create:
+            # Sparse mode: the aggregate is registered without zones, so create this address's zone on first use
             if address.version == 4:
-                forward_rdataset.add(dns.rdtypes.IN.A.A(dns.rdataclass.IN, dns.rdatatype.A, str(address)), self._ttl)
+                network = ipaddress.IPv4Network((int(address) & 0xffffff00, 24))
+            zone_name = self._create_reverse_zone(network)
+        return zone_name
+
+    def generate_zones(self, forward_domains: List[str], sparse_reverse: bool = False,
+                       always_emit: Optional[List[ipaddress._BaseNetwork]] = None,
+                       address_filters: Optional[Dict[str, List[str]]] = None, track_hosts: bool = False):
+        """
+        Build the forward and reverse zones from Netbox.
+
+        If sparse_reverse is set, reverse zones are only created once a PTR record lands in them, plus any zones
+        covering the networks in always_emit (e.g. delegations that must exist even when empty).
+
+        address_filters limits the IP Addresses used to those matching every one of the given ADDRESS_FILTERS, each
+        with a list of allowed values ('null' for none, e.g. vrf_id=['null'] for the global table).
+
+        track_hosts keeps the records added for each IP Address, for update_host().
+        """
+        address_filters = {key: [str(value) for value in values] for key, values in (address_filters or {}).items()}
+        for key in address_filters:
+            if key not in self.ADDRESS_FILTERS:
+                raise ValueError('Unknown IP Address filter %s' % key)
+        self.address_filters = address_filters
+        self.hosts = {} if track_hosts else None
+        self._host_refs = {}
+        self.host_records = HostRecords(self._ttl)
+
+        self.reverse_zones = PrefixIndex()
+        for prefix, in self.fetcher.fields('ipam.aggregates', ('prefix',)):
+            supernet: ipaddress._BaseNetwork = ipaddress.ip_network(prefix)
+            if sparse_reverse and supernet.version == 4 and supernet.prefixlen <= 24:
+                self.reverse_zones.insert(supernet, None)
+            elif sparse_reverse:
+                for network in self._reverse_zone_networks(supernet):
+                    self.reverse_zones.insert(network, None)
             else:
-                forward_rdataset.add(dns.rdtypes.IN.AAAA.AAAA(dns.rdataclass.IN, dns.rdatatype.AAAA, str(address)),
-                                     self._ttl)
-
-        reverse_zone: Optional[dns.zone.Zone] = None
-        for supernet, zone in self.reverse_zones.items():
-            if address in supernet:
-                reverse_zone = zone
-                break
-        if reverse_zone:
-            rev_name = dns.reversename.from_address(str(address))
-
-            ptr_rdataset = reverse_zone.find_rdataset(rev_name, dns.rdatatype.PTR, create=True)
-            ptr_rdataset.add(dns.rdtypes.ANY.PTR.PTR(dns.rdataclass.IN, dns.rdatatype.PTR, dns_name),
-                             self._ttl)
-
-    def _write_zone(self, zone: dns.zone.Zone, tempfile: str):
-        if os.path.exists(tempfile) == True:
-            os.remove(tempfile)
-        with open(tempfile, 'w') as f:
-            f.write(";\n")
-            f.write("; zone file built by netbox-utils dns generate\n")
-            f.write("; %s\n" % (zone.origin))
-
-            edit_warning = ";\n" + "; DO NOT EDIT THIS FILE!\n" + "; This file is automatically generated and changes will be lost next time it is built.\n"
-            f.write(edit_warning)
-            f.write(";\n")
-
-            zone.to_file(f, sorted=True)
+                for network in self._reverse_zone_networks(supernet):
+                    self._create_reverse_zone(network)
+
+        for network in always_emit or []:
+            if network.version == 4:
+                if network.prefixlen > 24:
+                    network = network.supernet(new_prefix=24)
+                for subnet in network.subnets(new_prefix=24):
+                    if self._find_reverse_zone(subnet.network_address) is None:
+                        self._create_reverse_zone(subnet)
+            else:
+                # The network gets its own zone even inside an aggregate's, e.g. a /48 delegated from a /32
+                for subnet in self._reverse_zone_networks(network):
+                    match = self.reverse_zones.lookup_network(subnet.network_address)
+                    if match is None or match[0] != subnet or match[1] is None:
+                        self._create_reverse_zone(subnet)
 
-            f.write(edit_warning)
+        self.forward_zones = {}
+        for zone_name in forward_domains: #self.FWD_DOMAINS:
+            zone = self._create_zone(zone_name + '.')
+            self.forward_zones[zone.origin] = zone_name + '.'
+
+        # Only the fields used are fetched, as plain tuples. Netbox is asked to leave out addresses without a name or
+        # not matching the filters, but they are checked again here as the snapshot cache holds every address.
+        checks = [(pos, self.ADDRESS_FILTERS[key][1], set(values))
+                  for pos, (key, values) in enumerate(address_filters.items(), 3)]
+        fields = ['address', 'dns_name', 'vrf'] + [self.ADDRESS_FILTERS[key][0] for key in address_filters]
+        if track_hosts:
+            fields.append('id')
+        hints = dict(address_filters, dns_name__empty='false')
+        zone_vrfs: Dict[str, set] = {}
+        for values in self.fetcher.fields('ipam.ip_addresses', fields, hints=hints):
+            address, dns_name, vrf = values[:3]
+            if not dns_name or any(_filter_value(values[pos], attr) not in allowed for pos, attr, allowed in checks):
+                continue
+            address = ipaddress.ip_interface(address).ip
+            reverse_zone = self._add_host_records(address, dns_name)
+            if track_hosts:
+                self._track_host(values[-1], (address, dns_name))
+            if reverse_zone is not None:
+                zone_vrfs.setdefault(reverse_zone, set()).add(_filter_value(vrf, 'id'))
+
+        # Addresses in different VRFs can overlap, which would silently merge their PTRs into the same zone
+        for zone_name, vrfs in sorted(zone_vrfs.items()):
+            if len(vrfs) > 1:
+                print('WARNING: reverse zone %s has addresses from more than one VRF (%s). Use --per-vrf or dns_vrf to '
+                      'keep them apart.' % (zone_name, ', '.join(sorted(vrfs))), file=sys.stderr)
+
+    def _find_forward_zone(self, name: dns.name.Name) -> Optional[str]:
+        # Walk the labels from most to least specific so the deepest zone containing the name wins
+        while len(name) > 1:
+            zone_name = self.forward_zones.get(name)
+            if zone_name is not None:
+                return zone_name
+            name = name.parent()
+        return None
+
+    def _name_id(self, dns_name: str) -> int:
+        name_id = self.host_records.find_name(dns_name)
+        if name_id is None:
+            name = dns.name.from_text(dns_name)
+            name_id = self.host_records.add_name(name, self._find_forward_zone(name), dns_name)
+        return name_id
+
+    def _add_host_records(self, address: ipaddress._BaseAddress, dns_name: str) -> Optional[str]:
+        """Add the A/AAAA and PTR records for an address where there are zones for them. Returns the reverse zone."""
+        reverse_zone = self._find_reverse_zone(address)
+        self.host_records.add(self._name_id(dns_name), address.version, int(address), reverse_zone)
+        return reverse_zone
+
+    def _remove_host_records(self, address: ipaddress._BaseAddress, dns_name: str) -> List[str]:
+        """Remove the records added by _add_host_records(). Returns the zones they were in."""
+        name_id = self._name_id(dns_name)
+        # A zone that doesn't exist yet holds no records to remove, so it isn't created
+        reverse_zone = self._find_reverse_zone(address, create=False)
+        self.host_records.remove(name_id, address.version, int(address), reverse_zone)
+        return [zone_name for zone_name in (self.host_records.name_zone(name_id), reverse_zone) if zone_name]
+
+    def _track_host(self, host_id: int, host: Tuple[ipaddress._BaseAddress, str]):
+        self.hosts[host_id] = host
+        self._host_refs[host] = self._host_refs.get(host, 0) + 1
+
+    def update_host(self, ip_address: Dict[str, Any], deleted: bool = False) -> Set[str]:
+        """
+        Apply a created, changed or deleted IP Address, as returned by the Netbox API, to zones generated with
+        track_hosts. Returns the names of the zones whose records may have changed.
+        """
+        new = None
+        if not deleted and ip_address.get('dns_name') and all(
+                _filter_value(ip_address.get(self.ADDRESS_FILTERS[key][0]), self.ADDRESS_FILTERS[key][1]) in values
+                for key, values in self.address_filters.items()):
+            new = (ipaddress.ip_interface(ip_address['address']).ip, ip_address['dns_name'])
+        old = self.hosts.get(ip_address['id'])
+        if new == old:
+            return set()
+
+        zones: List[Optional[str]] = []
+        if old is not None:
+            del self.hosts[ip_address['id']]
+            self._host_refs[old] -= 1
+            # Another IP Address may still give the same records
+            if not self._host_refs[old]:
+                del self._host_refs[old]
+                zones += self._remove_host_records(*old)
+        if new is not None:
+            self._track_host(ip_address['id'], new)
+            reverse_zone = self._add_host_records(*new)
+            zones += [self.host_records.name_zone(self._name_id(new[1])), reverse_zone]
+        return {zone_name for zone_name in zones if zone_name}
+
+    def _zone_header(self, zone: dns.zone.Zone) -> str:
+        return ";\n; zone file built by netbox-utils dns generate\n; %s\n%s;\n" % (zone.origin, self.EDIT_WARNING)
+
+    def _zone_trailer(self, zone: dns.zone.Zone) -> str:
+        return self.EDIT_WARNING
 
     def _get_zone_file(self, zone: dns.zone.Zone) -> str:
         zone_name = zone.origin.to_text(omit_final_dot=True)
-        return 'out/zones/%s' % (zone_name)
-
-    def output_zones(self):
-        for zone_name, zone in self.zones.items():
-            tempfile = self._get_zone_file(zone)
-            self._write_zone(zone, tempfile)
-
-    def _check_zone(self, zone: str, file: str) -> bool:
-        checkcmd = '/usr/sbin/named-checkzone %s %s' % (zone, file)
-        checkresult = os.popen(checkcmd).read()
-        return checkresult.endswith("OK\n")
+        return os.path.join(self.output_root, 'zones', zone_name)
+
+    def zone_records(self, zone_name: str, relativize: bool = True) -> render.Records:
+        """The zone's records, including its hosts, in the form they are rendered from"""
+        zone = self.zones[zone_name]
+        return render.zone_records(zone, self.host_records.zone_records(zone_name, zone.origin, relativize), relativize)
+
+    def _get_serial(self, zone: dns.zone.Zone) -> int:
+        return zone.find_rdataset('@', dns.rdatatype.SOA)[0].serial
+
+    def _set_serial(self, zone: dns.zone.Zone, serial: int):
+        soa_rdataset = zone.find_rdataset('@', dns.rdatatype.SOA)
+        zone.replace_rdataset('@', dns.rdataset.from_rdata(soa_rdataset.ttl, soa_rdataset[0].replace(serial=serial)))
+
+    def _load_manifest(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self.manifest_file):
+            return {}
+        with open(self.manifest_file, 'r') as f:
+            return json.load(f)
+
+    def save_manifest(self, failed: Optional[List[str]] = None):
+        """
+        Record the zones written by output_zones. Call once they have been verified, giving any that failed so that
+        they are written again, with a new serial, next time.
+        """
+        for zone_name in failed or []:
+            self._manifest[zone_name] = dict(self._manifest[zone_name], hash=None)
+        with open(self.manifest_file + '.tmp', 'w') as f:
+            json.dump(self._manifest, f, indent=1, sort_keys=True)
+        os.replace(self.manifest_file + '.tmp', self.manifest_file)
+
+    def output_zones(self, force: bool = False, swap_dirs: bool = False, zone_names: Optional[List[str]] = None,
+                     render_jobs: Optional[int] = None) -> List[str]:
+        """
+        Write out the zones whose content has changed since the last run, bumping their serials. Zones are compared
+        by a hash of their records (ignoring the SOA serial) against the manifest. Returns the changed zone names.
+
+        If zone_names is given only those zones are compared, and the rest are left as they were.
+
+        Files are only staged: check_zones() checks the staged files, and publish_zones() then moves them into place
+        atomically, or with swap_dirs flips the output directories, which are symlinks, to a new generation directory.
+        discard_zones() drops them instead.
+
+        With render_jobs, the zones are hashed, rendered and written by that many worker processes, each given the
+        zone's records rather than the zone itself. The files are the same either way.
+        """
+        output = self._output = StagedOutput(self.output_dirs, root=self.output_root, swap_dirs=swap_dirs)
+        previous = self._load_manifest()
+        self._manifest = {} if zone_names is None else dict(previous)
+        if zone_names is None:
+            zone_names = list(self.zones)
+
+        executor = None
+        jobs_order = zone_names
+        if render_jobs:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=render_jobs)
+            # Largest zones first, so that they don't hold up the end of the run
+            jobs_order = sorted(zone_names, key=lambda zone_name: -self.host_records.size(zone_name))
+        results = {}
+        for zone_name in jobs_order:
+            zone = self.zones[zone_name]
+            path = self._get_zone_file(zone)
+            old = previous.get(zone_name)
+            job = (self.zone_records(zone_name), self._zone_header(zone), self._zone_trailer(zone),
+                   output.staging_path(path),
+                   self._get_serial(zone), old['serial'] if old else None,
+                   old['hash'] if old and not force and os.path.exists(path) else None)
+            results[zone_name] = (path, executor.submit(render.render_zone_file, *job) if executor
+                                  else render.render_zone_file(*job))
+        if executor:
+            executor.shutdown()
+
+        self.changed_zones = []
+        for zone_name in zone_names:
+            path, result = results[zone_name]
+            zone_hash, serial, written = result.result() if executor else result
+            if serial != self._get_serial(self.zones[zone_name]):
+                self._set_serial(self.zones[zone_name], serial)
+            self._manifest[zone_name] = {'hash': zone_hash, 'serial': serial}
+            if written:
+                output.add_staged(path)
+                self.changed_zones.append(zone_name)
+        return self.changed_zones
+
+    def publish_zones(self):
+        """Move the zone files staged by output_zones into place"""
+        self._output.publish()
+        self._output = None
+
+    def discard_zones(self):
+        """Drop the zone files staged by output_zones, leaving the published zones as they were"""
+        self._output.discard()
+        self._output = None
+
+    def _check_zone(self, zone: str, file: str) -> Tuple[bool, str]:
+        try:
+            result = subprocess.run([self.checkzone, zone, file], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    universal_newlines=True)
+        except OSError as e:
+            return False, str(e)
+        return result.returncode == 0, result.stdout
+
+    def verify_zones(self, jobs: Optional[int] = None, zone_names: Optional[List[str]] = None):
+        if self.check_zones(jobs, zone_names):
+            self.discard_zones()
+            print('Validation failed, aborting without publishing any zones', file=sys.stderr)
+            sys.exit(1)
 
-    def verify_zones(self):
+    def check_zones(self, jobs: Optional[int] = None, zone_names: Optional[List[str]] = None) -> List[str]:
+        """Check the zone files staged by output_zones with checkzone, and return the names of those that failed"""
         if os.name == 'nt':
             print('Unable to verify zones under Windows - skipping')
-            return
-
-        ok = not_ok = 0
-        for zone_name, zone in self.zones.items():
-            tempfile = self._get_zone_file(zone)
-            if self._check_zone(zone_name, tempfile):
-                ok += 1
-            else:
-                print('VALIDATION FAILED: %s for %s' % (tempfile, zone_name))
-                not_ok += 1
-
-        print('Zone validation: %d ok, %d not ok' % (ok, not_ok))
-
-        if not_ok > 0:
-            print('Validation failed, aborting', file=sys.stderr)
-            sys.exit(1)
+            return []
+
+        jobs = jobs or os.cpu_count() or 1
+        if zone_names is None:
+            zone_names = list(self.zones.keys())
+        checks = [(zone_name, self._get_zone_file(self.zones[zone_name])) for zone_name in zone_names]
+        if self._output is not None:
+            checks = [(zone_name, self._output.staged_file(file)) for zone_name, file in checks]
+        print('Checking %d zones with %d jobs' % (len(checks), jobs))
+
+        started = time.time()
+        ok = 0
+        failed = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            # map() yields in submission order, so failures are reported deterministically
+            results = executor.map(lambda check: self._check_zone(*check), checks)
+            for (zone_name, tempfile), (zone_ok, output) in zip(checks, results):
+                if zone_ok:
+                    ok += 1
+                else:
+                    print('VALIDATION FAILED: %s for %s' % (tempfile, zone_name))
+                    for line in output.splitlines():
+                        print('  %s' % line)
+                    failed.append(zone_name)
+
+        print('Zone validation: %d ok, %d not ok (%.1fs)' % (ok, len(failed), time.time() - started))
+        return failed
 
     def add_dns_extras(self, extra_file):
         # Add extras
@@ -220,42 +497,59 @@ class EmfZonesGenerator(ZonesGenerator):
 
     NS_LIST = ['ns1.emfcamp.org.', 'auth1.ns.sargasso.net.', 'auth2.ns.sargasso.net.', 'auth3.ns.sargasso.net.']
 
-    codenames: List[str] = []
-    codenamepos: int = 0
-
     def __init__(self, netbox: Api, config: ConfigParser):
         super().__init__(netbox, self.SOA_NS, self.SOA_ADMIN, self.SOA_REFRESH, self.SOA_RETRY, self.SOA_EXPIRE,
                          self.TTL, self.NS_LIST)
         self.domain_campers = config['dhcpd']['domain_campers']
         self.domain_orga = config['dhcpd']['domain_orga']
 
-        with open('dns-codenames.txt', 'r') as file:
-            for line in file:
-                line = line.strip().replace(' ', '')
-                if line:
-                    self.codenames.append(line)
+        self.codenames = CodenameTable.from_file('dns-codenames.txt')
 
     def _add_dhcp_hostnames(self):
-        prefixes = self.netbox.ipam.prefixes.filter(cf_dhcp=True, family=4)
-
-        for prefix in prefixes:
+        pools = []
+        for prefix in self.netbox.ipam.prefixes.filter(cf_dhcp=True, family=4):
             reserved = prefix.dhcp_reserved if 'dhcp_reserved' in prefix else 10
             network = ipaddress.IPv4Network(prefix.prefix)
-            pool_start = network.network_address + 1 + reserved
-            pool_end = network.broadcast_address - 1
-
-            address = pool_start
-            while address <= pool_end:
-                domain = self.domain_campers if 'Camper-' in prefix.description else self.domain_orga
-
-                fqdn = '%s.%s' % (self._pretty_hostname_ipv4(address, domain), domain)
-                # TODO this needs to only overwrite the PTR if it doesn't exist.
-                # e.g. if we assign address 63 on video vlan via netbox, that record should take priority
-                # even though the address is part of the dhcp range.
-                # Note: It should still "use up" that codename, so that things following it are not automatically
-                # renumbered!
-                self._add_host_records(address, fqdn)
-                address += 1
+            domain = self.domain_campers if 'Camper-' in prefix.description else self.domain_orga
+            pools.append((int(network.network_address) + 1 + reserved, int(network.broadcast_address) - 1, domain))
+
+        try:
+            self.codenames.allocate([(start, end) for start, end, domain in pools if domain != self.domain_orga])
+        except ValueError as e:
+            print('Cannot name DHCP pools: %s' % e, file=sys.stderr)
+            sys.exit(1)
+
+        taken = self.host_records.ptr_addresses(4)
+        for pool_start, pool_end, domain in pools:
+            self._add_pool_records(pool_start, pool_end, domain, taken)
+
+    def _add_pool_records(self, pool_start: int, pool_end: int, domain: str, taken: Set[int]):
+        """
+        Add A and PTR records for a whole DHCP pool. Names are built directly as dns.name.Name from the integer
+        addresses, and the reverse zone is looked up once per /24 rather than once per address.
+
+        An address in taken, which already has a PTR, keeps its records, e.g. a host given a fixed address on the video
+        VLAN within the pool. Addresses given PTRs here are added to taken.
+        """
+        domain_name = dns.name.from_text(domain)
+        forward_zone = self._find_forward_zone(domain_name)
+
+        for block in range(pool_start & ~0xff, pool_end + 1, 0x100):
+            reverse_zone = self._find_reverse_zone(ipaddress.IPv4Address(max(block, pool_start)))
+            for address in range(max(block, pool_start), min(block | 0xff, pool_end) + 1):
+                if address in taken:
+                    continue
+
+                if domain == self.domain_orga:
+                    label = b'host-%d-%d-%d-%d' % (address >> 24, (address >> 16) & 0xff, (address >> 8) & 0xff,
+                                                   address & 0xff)
+                else:
+                    label = self.codenames.codename(address).encode()
+
+                name_id = self.host_records.add_name(dns.name.Name((label,) + domain_name.labels), forward_zone)
+                self.host_records.add(name_id, 4, address, reverse_zone)
+                if reverse_zone is not None:
+                    taken.add(address)
 
     # noinspection PyMethodOverriding
     def generate_zones(self):
@@ -264,24 +558,6 @@ class EmfZonesGenerator(ZonesGenerator):
         self._add_dhcp_hostnames()
         self.add_dns_extras('dns-extra.yaml')
 
-    def _pretty_hostname_ipv4(self, address: ipaddress.IPv4Address, domain: str) -> str:
-        if domain == self.domain_orga:
-            octets = address.packed
-            return 'host-%s-%s-%s-%s' % (str(octets[0]), str(octets[1]), str(octets[2]), str(octets[3]))
-        else:
-            if (self.codenamepos % len(self.codenames) == self.codenamepos / len(self.codenames)):
-                self.codenamepos += 1
-            code1 = self.codenamepos // len(self.codenames)
-            code2 = self.codenamepos % len(self.codenames)
-            if code1 >= len(self.codenames):
-                print("RUN OUT OF self.codenames AT POS %d" % self.codenamepos, file=sys.stderr)
-                exit(1)
-
-            codename1 = self.codenames[code1]
-            codename2 = self.codenames[code2]
-            self.codenamepos += 1
-            return codename1 + "-" + codename2
-
     def _is_zone_signed(self, zone: dns.zone.Zone) -> bool:
         zone_name = zone.origin.to_text(omit_final_dot=True)
         for signed_zone_name in self.SIGNED_ZONES:
@@ -292,13 +568,12 @@ class EmfZonesGenerator(ZonesGenerator):
     def _get_zone_file(self, zone: dns.zone.Zone) -> str:
         if self._is_zone_signed(zone):
             zone_name = zone.origin.to_text(omit_final_dot=True)
-            return 'out/signed-zones/%s' % (zone_name)
+            return os.path.join(self.output_root, 'signed-zones', zone_name)
         else:
             return super()._get_zone_file(zone)
 
-    def finalise_zones(self):
-        for zone_name, zone in self.zones.items():
-            if self._is_zone_signed(zone):
-                tempfile = self._get_zone_file(zone)
-                with open(tempfile, 'a') as f:
-                    f.write("\n$INCLUDE dnskey.db\n")
+    def _zone_trailer(self, zone: dns.zone.Zone) -> str:
+        text = super()._zone_trailer(zone)
+        if self._is_zone_signed(zone):
+            text += "\n$INCLUDE dnskey.db\n"
+        return text
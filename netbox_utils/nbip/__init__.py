@@ -1,10 +1,32 @@
+import csv
 import ipaddress
 import sys
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
 
 import click
+import requests
 import validators
+import yaml
 from click import Context
-from pynetbox.core.api import Api
+
+from netbox_utils.fetch import Fetcher
+from netbox_utils.prefix_index import PrefixIndex
+from netbox_utils.profile import Profiler
+
+FORMAT_HELP = ('Use {0} for the whole address. For IPv4 use {1} for octet 1, {2} for octet 2 etc; for IPv6 use {1} '
+               'to {32} for the nibbles, most significant first')
+
+
+class ReverseRange(NamedTuple):
+    start_ip: ipaddress._BaseAddress
+    end_ip: ipaddress._BaseAddress
+    dns_format: str
+
+
+class Changes(NamedTuple):
+    creates: List[Dict[str, Any]]
+    updates: List[Dict[str, Any]]
+    unchanged: int
 
 
 @click.group()
@@ -12,110 +34,252 @@ def ip():
     pass
 
 
-def validate_ipv4(ctx, param, value):
+def validate_ip(ctx, param, value):
     try:
-        return ipaddress.IPv4Address(value)
-    except ipaddress.AddressValueError as e:
+        return ipaddress.ip_address(value)
+    except ValueError as e:
         raise click.BadParameter(str(e))
 
 
+def format_dns_name(dns_format: str, address: ipaddress._BaseAddress) -> str:
+    if address.version == 4:
+        return dns_format.format(str(address), *address.packed)
+    return dns_format.format(str(address), *format(int(address), '032x'))
+
+
 @ip.command(help='Create or update IP Address records with the given reverse DNS. The subnet mask is automatically '
                  'set to the same as the parent prefix.')
-@click.option('--start', '-s', 'start_ip', help='Start IP', required=True, callback=validate_ipv4)
-@click.option('--end', '-e', 'end_ip', help='End IP', required=True, callback=validate_ipv4)
-@click.option('--format', '-f', 'dns_format', help='Reverse DNS format. Use {1} for octet 1, {2} for octet 2 etc',
-              required=True)
+@click.option('--start', '-s', 'start_ip', help='Start IP', required=True, callback=validate_ip)
+@click.option('--end', '-e', 'end_ip', help='End IP', required=True, callback=validate_ip)
+@click.option('--format', '-f', 'dns_format', help='Reverse DNS format. ' + FORMAT_HELP, required=True)
 @click.option('--dry-run', '-n', is_flag=True, help='Dry run, don\'t actually set DNS')
 @click.option('--allow-all', '-a', is_flag=True,
-              help='Also allow setting what would be the subnet\'s network and broadcast addresses')
+              help='Also allow setting the subnet\'s network and IPv4 broadcast addresses')
+@click.option('--batch-size', '-b', type=click.IntRange(min=1), default=500, show_default=True,
+              help='Number of records to create or update per API request')
 @click.pass_context
-def set_reverse(ctx: Context, start_ip: ipaddress.IPv4Address, end_ip: ipaddress.IPv4Address, dns_format: str,
-                dry_run: bool = False, allow_all: bool = False):
-    netbox: Api = ctx.obj['netbox']
+def set_reverse(ctx: Context, start_ip: ipaddress._BaseAddress, end_ip: ipaddress._BaseAddress, dns_format: str,
+                dry_run: bool = False, allow_all: bool = False, batch_size: int = 500):
+    fetcher: Fetcher = ctx.obj['fetcher']
+    reverse_range = ReverseRange(start_ip, end_ip, dns_format)
+
+    # Find a prefix that covers start_ip:
+
+    prefix = find_longest_prefix_containing_ip(fetcher, start_ip)
+    prefix_net = ipaddress.ip_network(prefix.prefix) if prefix else None
 
-    if start_ip > end_ip:
-        print('End address must be equal to or higher than the start address.', file=sys.stderr)
+    error = check_range(reverse_range, prefix_net, allow_all)
+    if error:
+        print(error, file=sys.stderr)
         sys.exit(1)
 
-    # Find a prefix that covers start_ip:
+    set_reverse_ranges(ctx.obj['profiler'], fetcher, [(reverse_range, prefix_net)], dry_run, batch_size)
 
-    prefix = find_longest_prefix_containing_ip(netbox, start_ip)
 
-    if not prefix:
-        print('No Netbox prefix found that covers %s' % str(start_ip), file=sys.stderr)
+@ip.command(help='Create or update IP Address records with reverse DNS for every range in a CSV or YAML file, giving '
+                 'start, end and format for each range. All prefixes are loaded once to find each range\'s parent '
+                 'prefix and mask. Format: ' + FORMAT_HELP)
+@click.argument('ranges_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--dry-run', '-n', is_flag=True, help='Dry run, don\'t actually set DNS')
+@click.option('--allow-all', '-a', is_flag=True,
+              help='Also allow setting the subnet\'s network and IPv4 broadcast addresses')
+@click.option('--batch-size', '-b', type=click.IntRange(min=1), default=500, show_default=True,
+              help='Number of records to create or update per API request')
+@click.pass_context
+def set_reverse_batch(ctx: Context, ranges_file: str, dry_run: bool = False, allow_all: bool = False,
+                      batch_size: int = 500):
+    fetcher: Fetcher = ctx.obj['fetcher']
+    reverse_ranges = load_ranges(ranges_file)
+
+    prefixes: PrefixIndex[None] = PrefixIndex()
+    for prefix in fetcher.all('ipam.prefixes'):
+        prefixes.insert(ipaddress.ip_network(prefix.prefix), None)
+
+    # Check every range before changing anything
+    resolved: List[Tuple[ReverseRange, ipaddress._BaseNetwork]] = []
+    errors = 0
+    for reverse_range in reverse_ranges:
+        match = prefixes.lookup_network(reverse_range.start_ip)
+        prefix_net = match[0] if match else None
+        error = check_range(reverse_range, prefix_net, allow_all)
+        if error:
+            print(error, file=sys.stderr)
+            errors += 1
+        resolved.append((reverse_range, prefix_net))
+    for error in find_overlaps(reverse_ranges):
+        print(error, file=sys.stderr)
+        errors += 1
+    if errors:
         sys.exit(1)
 
-    prefix_net = ipaddress.IPv4Network(prefix.prefix)
-    prefix_len = prefix_net.prefixlen
+    set_reverse_ranges(ctx.obj['profiler'], fetcher, resolved, dry_run, batch_size)
+
+
+def set_reverse_ranges(profiler: Profiler, fetcher: Fetcher,
+                       resolved: List[Tuple[ReverseRange, ipaddress._BaseNetwork]], dry_run: bool, batch_size: int):
+    with profiler.phase('fetch_ip_addresses'):
+        existing = fetch_ip_addresses(fetcher, list(dict.fromkeys(prefix_net for _, prefix_net in resolved)))
+    with profiler.phase('plan_changes'):
+        changes = plan_changes(resolved, existing)
+    with profiler.phase('apply_changes'):
+        apply_changes(fetcher, changes, dry_run, batch_size)
+
+
+def load_ranges(ranges_file: str) -> List[ReverseRange]:
+    """Read start/end/format ranges from a YAML list of mappings, or a CSV file with a header row"""
+    with open(ranges_file, 'r', newline='') as f:
+        if ranges_file.endswith(('.yaml', '.yml')):
+            rows = yaml.safe_load(f) or []
+        else:
+            rows = list(csv.DictReader(f))
+
+    reverse_ranges = []
+    for pos, row in enumerate(rows, 1):
+        try:
+            reverse_ranges.append(ReverseRange(ipaddress.ip_address(str(row['start']).strip()),
+                                               ipaddress.ip_address(str(row['end']).strip()),
+                                               row['format'].strip()))
+        except (KeyError, ValueError) as e:
+            print('%s: range %d is invalid: %s' % (ranges_file, pos, str(e)), file=sys.stderr)
+            sys.exit(1)
+    return reverse_ranges
+
+
+def check_range(reverse_range: ReverseRange, prefix_net: Optional[ipaddress._BaseNetwork],
+                allow_all: bool) -> Optional[str]:
+    """Return why a range can't be set within its parent prefix, or None if it can"""
+    start_ip, end_ip, dns_format = reverse_range
+
+    if start_ip.version != end_ip.version or start_ip > end_ip:
+        return 'End address %s must be equal to or higher than the start address %s.' % (str(end_ip), str(start_ip))
+
+    if not prefix_net:
+        return 'No Netbox prefix found that covers %s' % str(start_ip)
 
     # Check that end_ip is in the same prefix
 
     if end_ip not in prefix_net:
-        print(
-            'The end address %s is not in the same prefix %s as the start address %s.' % (str(end_ip), str(prefix_net),
-                                                                                          str(start_ip)),
-            file=sys.stderr)
-        sys.exit(1)
+        return 'The end address %s is not in the same prefix %s as the start address %s.' % (str(end_ip),
+                                                                                            str(prefix_net),
+                                                                                            str(start_ip))
 
-    # Check that we're not accidentally setting the network or broadcast addresses
+    # Check that we're not accidentally setting the network or broadcast addresses. IPv6 has no broadcast address, only
+    # the subnet-router anycast address, which is the network address.
 
-    if not allow_all and (start_ip == prefix_net.network_address or start_ip == prefix_net.broadcast_address or
-                          end_ip == prefix_net.network_address or end_ip == prefix_net.broadcast_address):
-        print('You have requested to include the network/broadcast address and not specified --allow-all.',
-              file=sys.stderr)
-        sys.exit(1)
+    if not allow_all and start_ip == prefix_net.network_address:
+        return 'Range %s - %s includes the network address and --allow-all was not specified.' % (
+            str(start_ip), str(end_ip))
+    if not allow_all and prefix_net.version == 4 and end_ip == prefix_net.broadcast_address:
+        return 'Range %s - %s includes the broadcast address and --allow-all was not specified.' % (
+            str(start_ip), str(end_ip))
 
-    # Loop the addresses and create or update their IP Address records:
+    return None
 
-    created = updated = unchanged = 0
-    ip = start_ip
-    while ip <= end_ip:
-        ip_int: ipaddress.IPv4Interface = ipaddress.IPv4Interface('%s/%d' % (str(ip), prefix_len))
 
-        # get the current record if it exists
-        nb_ip = netbox.ipam.ip_addresses.get(address=str(ip_int))
+def find_overlaps(reverse_ranges: List[ReverseRange]) -> List[str]:
+    """Return why each pair of overlapping ranges can't be set together, as each would create the shared addresses"""
+    errors = []
+    ordered = sorted((r for r in reverse_ranges if r.start_ip.version == r.end_ip.version and r.start_ip <= r.end_ip),
+                     key=lambda r: (r.start_ip.version, r.start_ip))
+    furthest = None
+    for reverse_range in ordered:
+        if (furthest is not None and furthest.end_ip.version == reverse_range.start_ip.version
+                and reverse_range.start_ip <= furthest.end_ip):
+            errors.append('Range %s - %s overlaps range %s - %s.' % (str(reverse_range.start_ip),
+                                                                     str(reverse_range.end_ip),
+                                                                     str(furthest.start_ip), str(furthest.end_ip)))
+        if (furthest is None or furthest.end_ip.version != reverse_range.end_ip.version
+                or reverse_range.end_ip > furthest.end_ip):
+            furthest = reverse_range
+    return errors
 
-        dns_name = dns_format.format(str(ip_int.ip),
-                                     ip_int.ip.packed[0],
-                                     ip_int.ip.packed[1],
-                                     ip_int.ip.packed[2],
-                                     ip_int.ip.packed[3])
 
-        if not validators.domain(dns_name):
-            print('Given format string would produce illegal reverse DNS "%s" for %s.' % (dns_name, str(ip_int)),
-                  file=sys.stderr)
-            sys.exit(1)
+def fetch_ip_addresses(fetcher: Fetcher,
+                       prefix_nets: List[ipaddress._BaseNetwork]) -> Dict[ipaddress._BaseAddress, Dict[str, Any]]:
+    """Fetch all the existing IP Address records in the prefixes, one query per prefix, keyed by host address"""
+    existing: Dict[ipaddress._BaseAddress, Dict[str, Any]] = {}
+    for prefix_net in prefix_nets:
+        for nb_ip in fetcher.raw('ipam.ip_addresses', parent=str(prefix_net)):
+            host = ipaddress.ip_interface(nb_ip['address']).ip
+            if host in existing and existing[host]['id'] != nb_ip['id']:
+                print('More than one IP Address record found for %s.' % str(host), file=sys.stderr)
+                sys.exit(1)
+            existing[host] = nb_ip
+    return existing
+
+
+def plan_changes(resolved: List[Tuple[ReverseRange, ipaddress._BaseNetwork]],
+                 existing: Dict[ipaddress._BaseAddress, Dict[str, Any]]) -> Changes:
+    """Loop the addresses in each range and work out which records to create or update"""
+    creates: List[Dict[str, Any]] = []
+    updates: List[Dict[str, Any]] = []
+    unchanged = 0
+    for (start_ip, end_ip, dns_format), prefix_net in resolved:
+        ip = start_ip
+        while ip <= end_ip:
+            ip_int = ipaddress.ip_interface('%s/%d' % (str(ip), prefix_net.prefixlen))
 
-        if nb_ip:
-            if nb_ip.dns_name == dns_name:
-                print('UNCHANGED: %s -> %s' % (str(ip_int), dns_name))
-                unchanged += 1
+            nb_ip = existing.get(ip)
+
+            dns_name = format_dns_name(dns_format, ip)
+
+            if not validators.domain(dns_name):
+                print('Given format string would produce illegal reverse DNS "%s" for %s.' % (dns_name, str(ip_int)),
+                      file=sys.stderr)
+                sys.exit(1)
+
+            if nb_ip:
+                if nb_ip['dns_name'] == dns_name:
+                    print('UNCHANGED: %s -> %s' % (str(ip_int), dns_name))
+                    unchanged += 1
+                else:
+                    print('UPDATE: %s -> %s (was %s)' % (str(ip_int), dns_name, nb_ip['dns_name']))
+                    updates.append({'id': nb_ip['id'], 'dns_name': dns_name})
             else:
-                print('UPDATE: %s -> %s (was %s)' % (str(ip_int), dns_name, nb_ip.dns_name))
-                updated += 1
-                if not dry_run:
-                    nb_ip.dns_name = dns_name
-                    nb_ip.save()
-        else:
-            print('CREATE: %s -> %s' % (str(ip_int), dns_name))
-            created += 1
-            if not dry_run:
-                netbox.ipam.ip_addresses.create(address=str(ip_int),
-                                                dns_name=dns_name)
+                print('CREATE: %s -> %s' % (str(ip_int), dns_name))
+                creates.append({'address': str(ip_int), 'dns_name': dns_name})
+
+            ip += 1
+
+    return Changes(creates, updates, unchanged)
 
-        ip += 1
 
-    print('%d created, %d updated, %d unchanged.' % (created, updated, unchanged))
+def apply_changes(fetcher: Fetcher, changes: Changes, dry_run: bool, batch_size: int):
+    failed = 0
+    if not dry_run:
+        failed += _write_batches(fetcher.bulk_create, 'create', changes.creates, batch_size)
+        failed += _write_batches(fetcher.bulk_update, 'update', changes.updates, batch_size)
+
+    print('%d created, %d updated, %d unchanged.' % (len(changes.creates), len(changes.updates), changes.unchanged))
     if dry_run:
         print('Dry run, nothing was changed.')
+    if failed:
+        print('%d changes failed, see above.' % failed, file=sys.stderr)
+        sys.exit(1)
+
+
+def _write_batches(write: Callable[[str, List[Dict[str, Any]]], Any], action: str, changes: List[Dict[str, Any]],
+                   batch_size: int) -> int:
+    """Send changes to the IP Address bulk endpoint in batches, reporting any that fail. Returns the failure count."""
+    failed = 0
+    for pos in range(0, len(changes), batch_size):
+        batch = changes[pos:pos + batch_size]
+        try:
+            write('ipam.ip_addresses', batch)
+        except requests.HTTPError as e:
+            print('FAILED: %s of %d records from offset %d: %s %s' % (action, len(batch), pos, str(e),
+                                                                    e.response.text if e.response is not None else ''),
+                  file=sys.stderr)
+            failed += len(batch)
+    return failed
 
 
-def find_longest_prefix_containing_ip(netbox, ip):
-    prefixes = netbox.ipam.prefixes.filter(contains=str(ip))
+def find_longest_prefix_containing_ip(fetcher: Fetcher, ip):
+    prefixes = fetcher.all('ipam.prefixes', contains=str(ip))
     found_prefix = None
     found_prefix_length = None
     for prefix in prefixes:
-        subnet = ipaddress.IPv4Network(prefix.prefix)
+        subnet = ipaddress.ip_network(prefix.prefix)
         if found_prefix is None or subnet.prefixlen > found_prefix_length:
             found_prefix = prefix
             found_prefix_length = subnet.prefixlen
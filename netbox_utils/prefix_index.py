@@ -0,0 +1,49 @@
+import ipaddress
+from typing import Dict, Generic, List, Optional, Tuple, TypeVar, Union
+
+T = TypeVar('T')
+
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+Address = Union[ipaddress.IPv4Address, ipaddress.IPv6Address]
+
+
+class PrefixIndex(Generic[T]):
+    """
+    Longest-prefix-match index from IP networks to values.
+
+    Networks are held in one hash table per (address family, prefix length), keyed on the integer network address.
+    A lookup masks the address once for each prefix length present, most specific first, so it costs at most
+    O(prefix length) dict probes regardless of how many networks are indexed.
+    """
+
+    _BITS = {4: 32, 6: 128}
+
+    def __init__(self):
+        self._tables: Dict[int, Dict[int, Dict[int, Tuple[Network, T]]]] = {4: {}, 6: {}}
+        # (prefix length, netmask) pairs present for each family, most specific first
+        self._masks: Dict[int, List[Tuple[int, int]]] = {4: [], 6: []}
+
+    def _mask(self, version: int, prefixlen: int) -> int:
+        bits = self._BITS[version]
+        return ((1 << prefixlen) - 1) << (bits - prefixlen)
+
+    def insert(self, network: Network, value: T):
+        version = network.version
+        prefixlen = network.prefixlen
+        tables = self._tables[version]
+        if prefixlen not in tables:
+            tables[prefixlen] = {}
+            self._masks[version].append((prefixlen, self._mask(version, prefixlen)))
+            self._masks[version].sort(reverse=True)
+        tables[prefixlen][int(network.network_address)] = (network, value)
+
+    def lookup_network(self, address: Address) -> Optional[Tuple[Network, T]]:
+        """Return the most specific (network, value) containing address, or None"""
+        version = address.version
+        tables = self._tables[version]
+        value = int(address)
+        for prefixlen, mask in self._masks[version]:
+            match = tables[prefixlen].get(value & mask)
+            if match is not None:
+                return match
+        return None
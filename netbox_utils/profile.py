@@ -0,0 +1,124 @@
+import contextlib
+import json
+import re
+import resource
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional
+from urllib.parse import urlsplit
+
+if TYPE_CHECKING:
+    import requests
+
+# Upper bounds of the request latency histogram buckets, in milliseconds
+LATENCY_BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+_ID_RE = re.compile(r'/\d+(?=/|$)')
+
+
+class EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def add(self, seconds: float, size: int, error: bool):
+        self.requests += 1
+        self.errors += error
+        self.bytes += size
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        ms = seconds * 1000
+        bucket = 0
+        while bucket < len(LATENCY_BUCKETS_MS) and ms > LATENCY_BUCKETS_MS[bucket]:
+            bucket += 1
+        self.buckets[bucket] += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        labels = ['<=%dms' % bound for bound in LATENCY_BUCKETS_MS] + ['>%dms' % LATENCY_BUCKETS_MS[-1]]
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'bytes': self.bytes,
+            'total_seconds': round(self.total, 6),
+            'mean_seconds': round(self.total / self.requests, 6) if self.requests else None,
+            'max_seconds': round(self.max, 6),
+            'histogram': dict(zip(labels, self.buckets)),
+        }
+
+
+class Profiler:
+    """
+    Collects per-phase wall times, per-endpoint HTTP request latencies and peak memory for one run, and writes them
+    out as a JSON report. Optionally also runs cProfile over the whole command.
+    """
+
+    def __init__(self, report_path: Optional[str] = None, stats_path: Optional[str] = None):
+        self.report_path = report_path
+        self.stats_path = stats_path
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self.phases: List[Dict[str, Any]] = []
+        self.endpoints: Dict[str, EndpointStats] = {}
+        self.api_version: Optional[str] = None
+        self._lock = threading.Lock()
+        self._cprofile = None
+        if stats_path:
+            import cProfile
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.report_path or self.stats_path)
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append({'phase': name, 'seconds': round(time.perf_counter() - start, 6)})
+
+    def record_response(self, response: 'requests.Response', *args, **kwargs):
+        """A requests response hook"""
+        path = urlsplit(response.request.url).path
+        endpoint = '%s %s' % (response.request.method, _ID_RE.sub('/{id}', path.split('/api/', 1)[-1]))
+        size = len(response.content)
+        with self._lock:
+            self.endpoints.setdefault(endpoint, EndpointStats()).add(response.elapsed.total_seconds(), size,
+                                                                    response.status_code >= 400)
+            self.api_version = response.headers.get('API-Version', self.api_version)
+
+    def report(self) -> Dict[str, Any]:
+        # ru_maxrss is in KiB on Linux but bytes on macOS
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            peak_rss //= 1024
+        return {
+            'argv': sys.argv[1:],
+            'started': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.started)),
+            'total_seconds': round(time.perf_counter() - self._start, 6),
+            'peak_rss_kib': peak_rss,
+            'netbox_api_version': self.api_version,
+            'phases': self.phases,
+            'http': {
+                'requests': sum(stats.requests for stats in self.endpoints.values()),
+                'endpoints': {endpoint: stats.as_dict() for endpoint, stats in sorted(self.endpoints.items())},
+            },
+        }
+
+    def close(self):
+        if self._cprofile:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self.stats_path)
+            print('cProfile stats written to %s' % self.stats_path, file=sys.stderr)
+        if self.report_path:
+            with open(self.report_path, 'w') as f:
+                json.dump(self.report(), f, indent=2)
+                f.write('\n')
+            print('Profile report written to %s' % self.report_path, file=sys.stderr)
@@ -1,40 +1,108 @@
+from collections import defaultdict
+from itertools import chain
 from operator import attrgetter
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
 
 import click
 from click import Context
+from pynetbox.core.response import Record
 
+from netbox_utils.fetch import Fetcher
+from netbox_utils.secrets.export import FORMATS, DumpOutput, open_output
 
-@click.command()
+
+def _chunks(ids: Sequence[int], size: int = 100) -> Iterator[Sequence[int]]:
+    # Keep id lists in query strings to a sensible length
+    for pos in range(0, len(ids), size):
+        yield ids[pos:pos + size]
+
+
+@click.command(help='Dump decrypted secrets. With any of the filters, only the matching devices that have matching '
+                    'secrets are listed, and only their secrets are fetched and decrypted.')
+@click.option('--site', 'sites', multiple=True, help='Only devices at this site (slug). May be repeated.')
+@click.option('--role', 'roles', multiple=True, help='Only devices with this device role (slug). May be repeated.')
+@click.option('--device', 'device_names', multiple=True, help='Only the device with this name. May be repeated.')
+@click.option('--secret-role', 'secret_roles', multiple=True,
+              help='Only secrets with this secret role (slug). May be repeated.')
+@click.option('--format', '-f', 'output_format', type=click.Choice(sorted(FORMATS)), default='text',
+              show_default=True, help='Output format. json, jsonl and csv give one record per secret.')
+@click.option('--output', '-o', 'output_file',
+              help='Write to this file instead of stdout. It is created readable by the owner only, and only '
+                   'replaces any existing file once complete.')
 @click.pass_context
-def dump(ctx: Context):
-    nb = ctx.obj['netbox']
-    devices = list(nb.dcim.devices.all())
+def dump(ctx: Context, sites: Tuple[str] = (), roles: Tuple[str] = (), device_names: Tuple[str] = (),
+         secret_roles: Tuple[str] = (), output_format: str = 'text', output_file: Optional[str] = None):
+    with open_output(output_file) as f:
+        output = FORMATS[output_format](f)
+        _dump(ctx.obj['fetcher'], output, sites, roles, device_names, secret_roles)
+        output.close()
 
-    devices.sort(key=attrgetter('site.name', 'device_role.name', 'name'))
 
-    secrets = list(nb.secrets.secrets.all())
-    secrets.sort(key=attrgetter('role.name', 'name'))
+def _dump(fetcher: Fetcher, output: DumpOutput, sites: Tuple[str], roles: Tuple[str], device_names: Tuple[str],
+          secret_roles: Tuple[str]):
+
+    # Filters are passed through to the API so that only what is needed is fetched and decrypted
+    device_filters = {key: list(values) for key, values in (('site', sites), ('role', roles), ('name', device_names))
+                      if values}
+    secret_filters = {'role': list(secret_roles)} if secret_roles else {}
+
+    if device_filters:
+        # Only the ids are needed at this stage, so use a brief listing
+        device_ids = [device['id'] for device in fetcher.raw('dcim.devices', brief=1, **device_filters)]
+        secrets = chain.from_iterable(fetcher.all('secrets.secrets', device_id=list(chunk), **secret_filters)
+                                      for chunk in _chunks(device_ids))
+    else:
+        secrets = fetcher.all('secrets.secrets', **secret_filters)
+
+    # Group the secrets once by the object they are assigned to
+    secrets_by_object: Dict[Tuple[str, int], List[Record]] = defaultdict(list)
+    for secret in secrets:
+        secrets_by_object[(secret.assigned_object_type, secret.assigned_object_id)].append(secret)
+    for object_secrets in secrets_by_object.values():
+        object_secrets.sort(key=attrgetter('role.name', 'name'))
+
+    if device_filters or secret_filters:
+        # Fetch the full representation only for the devices that have matching secrets
+        device_ids = [object_id for object_type, object_id in secrets_by_object if object_type == 'dcim.device']
+        devices = list(chain.from_iterable(fetcher.all('dcim.devices', id=list(chunk))
+                                           for chunk in _chunks(device_ids)))
+    else:
+        devices = list(fetcher.all('dcim.devices'))
+    devices.sort(key=attrgetter('site.name', 'device_role.name', 'name'))
 
     cursite = None
     curdevice = None
 
     for device in devices:
         if device.site.name != cursite:
-            print('Site: %s' % (device.site.name))
+            output.group('Site', device.site.name)
             cursite = device.site.name
         if device.name != curdevice:
-            print(' Device: %s' % (device.name), end='')
-            if device.primary_ip4:
-                print(' (%s)' % device.primary_ip4.address.split('/')[0], end='')
-            if device.primary_ip6:
-                print(' (%s)' % device.primary_ip6.address.split('/')[0], end='')
-            print()
+            output.object('Device', 'dcim.device', device)
             curdevice = device.name
 
-        mysecrets = (x for x in secrets if
-                     x.assigned_object_type == 'dcim.device' and x.assigned_object_id == device.id)
-        for secret in mysecrets:
-            print('  (%s) %s = %s' % (secret.role.name, secret.name, secret.plaintext))
+        output.secrets(secrets_by_object.pop(('dcim.device', device.id), []))
+
+    # Virtual machines are only listed if they have secrets, so skip fetching them if none do
+    if any(object_type == 'virtualization.virtualmachine' for object_type, _ in secrets_by_object):
+        vms = [vm for vm in fetcher.all('virtualization.virtual_machines')
+               if ('virtualization.virtualmachine', vm.id) in secrets_by_object]
+        vms.sort(key=lambda vm: (vm.cluster.name if vm.cluster else '', vm.name))
+
+        curcluster = None
+        for vm in vms:
+            cluster = vm.cluster.name if vm.cluster else '(none)'
+            if cluster != curcluster:
+                output.group('Cluster', cluster)
+                curcluster = cluster
+            output.object('Virtual machine', 'virtualization.virtualmachine', vm)
+            output.secrets(secrets_by_object.pop(('virtualization.virtualmachine', vm.id)))
+
+    # Anything else secrets can be assigned to
+    for (object_type, object_id), object_secrets in sorted(secrets_by_object.items()):
+        assigned_object = object_secrets[0].assigned_object
+        output.other_object(object_type, object_id, getattr(assigned_object, 'name', None) or object_id)
+        output.secrets(object_secrets)
 
 
 COMMANDS = [dump]
@@ -0,0 +1,158 @@
+import abc
+import contextlib
+import csv
+import json
+import os
+import sys
+import tempfile
+from typing import Any, Dict, Iterator, List, Optional, TextIO
+
+from pynetbox.core.response import Record
+
+
+def _primary_ip(obj: Record, attr: str) -> Optional[str]:
+    ip = getattr(obj, attr, None)
+    return ip.address.split('/')[0] if ip else None
+
+
+class DumpOutput:
+    """
+    Receives the secrets dump as it is walked: a group header (site or cluster), then each object followed by its
+    secrets. Subclasses write each part out as it arrives rather than collecting the whole dump.
+    """
+
+    def __init__(self, f: TextIO):
+        self.f = f
+
+    def group(self, label: str, name: str):
+        pass
+
+    def object(self, label: str, object_type: str, obj: Record):
+        pass
+
+    def other_object(self, object_type: str, object_id: int, name: str):
+        pass
+
+    def secrets(self, secrets: List[Record]):
+        pass
+
+    def close(self):
+        pass
+
+
+class TextOutput(DumpOutput):
+    """The indented human-readable listing"""
+
+    def group(self, label: str, name: str):
+        print('%s: %s' % (label, name), file=self.f)
+
+    def object(self, label: str, object_type: str, obj: Record):
+        print(' %s: %s' % (label, obj.name), end='', file=self.f)
+        for attr in ('primary_ip4', 'primary_ip6'):
+            if _primary_ip(obj, attr):
+                print(' (%s)' % _primary_ip(obj, attr), end='', file=self.f)
+        print(file=self.f)
+
+    def other_object(self, object_type: str, object_id: int, name: str):
+        print('Object: %s %s' % (object_type, name), file=self.f)
+
+    def secrets(self, secrets: List[Record]):
+        for secret in secrets:
+            print('  (%s) %s = %s' % (secret.role.name, secret.name, secret.plaintext), file=self.f)
+
+
+class RecordOutput(DumpOutput, abc.ABC):
+    """Base for the machine-readable formats, which write one flat record per secret"""
+
+    FIELDS = ['group_type', 'group', 'object_type', 'object_id', 'object', 'primary_ip4', 'primary_ip6',
+              'secret_id', 'role', 'name', 'plaintext']
+
+    def __init__(self, f: TextIO):
+        super().__init__(f)
+        self._group: Dict[str, Any] = {}
+        self._object: Dict[str, Any] = {}
+
+    def group(self, label: str, name: str):
+        self._group = {'group_type': label.lower(), 'group': name}
+
+    def object(self, label: str, object_type: str, obj: Record):
+        self._object = {'object_type': object_type, 'object_id': obj.id, 'object': obj.name,
+                        'primary_ip4': _primary_ip(obj, 'primary_ip4'), 'primary_ip6': _primary_ip(obj, 'primary_ip6')}
+
+    def other_object(self, object_type: str, object_id: int, name: str):
+        self._group = {}
+        self._object = {'object_type': object_type, 'object_id': object_id, 'object': name}
+
+    def secrets(self, secrets: List[Record]):
+        for secret in secrets:
+            record = dict.fromkeys(self.FIELDS)
+            record.update(self._group)
+            record.update(self._object)
+            record.update({'secret_id': secret.id, 'role': secret.role.name, 'name': secret.name,
+                           'plaintext': secret.plaintext})
+            self.write_record(record)
+
+    @abc.abstractmethod
+    def write_record(self, record: Dict[str, Any]):
+        pass
+
+
+class JsonLinesOutput(RecordOutput):
+    def write_record(self, record: Dict[str, Any]):
+        self.f.write(json.dumps(record) + '\n')
+
+
+class JsonOutput(RecordOutput):
+    """A JSON array, written an element at a time"""
+
+    def __init__(self, f: TextIO):
+        super().__init__(f)
+        self._separator = '[\n'
+
+    def write_record(self, record: Dict[str, Any]):
+        self.f.write(self._separator + json.dumps(record))
+        self._separator = ',\n'
+
+    def close(self):
+        self.f.write('[]\n' if self._separator == '[\n' else '\n]\n')
+
+
+class CsvOutput(RecordOutput):
+    def __init__(self, f: TextIO):
+        super().__init__(f)
+        self._writer = csv.DictWriter(f, fieldnames=self.FIELDS)
+        self._writer.writeheader()
+
+    def write_record(self, record: Dict[str, Any]):
+        self._writer.writerow(record)
+
+
+FORMATS = {
+    'text': TextOutput,
+    'json': JsonOutput,
+    'jsonl': JsonLinesOutput,
+    'csv': CsvOutput,
+}
+
+
+@contextlib.contextmanager
+def open_output(path: Optional[str]) -> Iterator[TextIO]:
+    """
+    Yield stdout, or a file that only appears at path once it has been completely written. The file is created
+    readable by the owner only, as it holds decrypted secrets.
+    """
+    if not path:
+        yield sys.stdout
+        return
+
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                     prefix='.%s.' % os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'w', newline='') as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
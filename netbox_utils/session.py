@@ -0,0 +1,70 @@
+import sys
+import threading
+from configparser import SectionProxy
+from typing import Optional, Tuple, Union
+
+import requests
+import requests.adapters
+from urllib3.util.retry import Retry
+
+# Only requests that are safe to repeat are retried
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+
+class CountingAdapter(requests.adapters.HTTPAdapter):
+    """HTTPAdapter that applies a default timeout and counts requests, retries and bytes received"""
+
+    def __init__(self, timeout: Union[float, Tuple[float, float], None] = None, **kwargs):
+        self.timeout = timeout
+        self.requests = 0
+        self.retries = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        super().__init__(**kwargs)
+
+    def send(self, request, stream=False, timeout=None, **kwargs):
+        response = super().send(request, stream=stream, timeout=timeout or self.timeout, **kwargs)
+        retries = len(response.raw.retries.history) if getattr(response.raw, 'retries', None) else 0
+        received = len(response.content) if not stream else 0
+        with self._lock:
+            self.requests += 1
+            self.retries += retries
+            self.bytes += received
+        return response
+
+
+def _parse_timeout(value: Optional[str]) -> Union[float, Tuple[float, float], None]:
+    # Either one timeout for both, or "connect,read"
+    if not value:
+        return None
+    parts = [float(part) for part in value.split(',')]
+    return (parts[0], parts[1]) if len(parts) > 1 else parts[0]
+
+
+def build_session(config: SectionProxy) -> requests.Session:
+    """
+    A requests session shared by everything that talks to Netbox, with a connection pool, timeouts and retries with
+    exponential backoff on idempotent requests, all set from the config section.
+    """
+    retry = Retry(total=config.getint('http_retries', 3),
+                  backoff_factor=config.getfloat('http_backoff', 0.5),
+                  status_forcelist=[429, 502, 503, 504],
+                  allowed_methods=IDEMPOTENT_METHODS,
+                  raise_on_status=False)
+    pool_size = config.getint('http_pool_size', max(config.getint('fetch_concurrency', 4), 10))
+    adapter = CountingAdapter(timeout=_parse_timeout(config.get('http_timeout', '10,300')),
+                              pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if not config.getboolean('http_keepalive', True):
+        session.headers['Connection'] = 'close'
+    return session
+
+
+def print_session_stats(session: requests.Session):
+    adapter = session.get_adapter('https://')
+    if isinstance(adapter, CountingAdapter):
+        print('HTTP: %d requests, %d retries, %d KiB received' % (adapter.requests, adapter.retries,
+                                                                 adapter.bytes // 1024), file=sys.stderr)
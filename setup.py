@@ -10,6 +10,7 @@ setup(
     description='Netbox importers/exporters',
     packages=find_packages(),
     include_package_data=True,
+    python_requires='>=3.9',
 
     install_requires=[
         'click',
@@ -19,6 +20,8 @@ setup(
         'dnspython',
         'PyYaml',
         'validators',
+        'requests',
+        'urllib3',
     ],
     entry_points={
         'console_scripts': [